@@ -0,0 +1,87 @@
+# Measures how much memory each NewsArticle keeps alive once the reply JSON it was built from is freed, next to the
+# __dict__ layout it had before it was given __slots__.
+# Run from the repository root: python benchmarks/article_memory.py
+import gc
+import hashlib
+import os
+import sys
+
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from newsapy.const import GARBAGE_SOURCES, TEXT_ENCODING_FORMAT
+from newsapy.newsapi_article import NewsArticle, format_text, parse_newsapi_time
+
+ARTICLE_COUNT = 100000
+
+
+def make_article_json(i):
+    return {"source": {"id": "reuters", "name": "Reuters"}, "author": "Jane Doe", "url": "https://www.reuters.com/article/us-story-{}".format(i),
+            "urlToImage": "https://www.reuters.com/resources/r/?m=02&d=20190601&t=2&i={}".format(i), "publishedAt": "2019-06-01T12:34:56Z",
+            "title": "Trump says he will meet Xi at G20 summit in Osaka, Japan number {}".format(i),
+            "description": "President Donald Trump said on Tuesday he would meet Chinese President Xi Jinping at the G20 summit in Osaka {}.".format(i),
+            "content": "WASHINGTON (Reuters) - U.S. President Donald Trump said on Tuesday he would meet with Chinese President Xi Jinping at the G20... [+1234 chars] {}".format(i)}
+
+
+class DictNewsArticle(object): # the fields NewsArticle kept before __slots__, laid out the way it kept them, for reference
+    def __init__(self, client, article_json):
+        self.__uid = None
+        self.id = None
+        self.source = article_json["source"]["name"]
+        self.authors = article_json["author"]
+        self.url = article_json["url"]
+        self.time_published = parse_newsapi_time(article_json["publishedAt"])
+        self.__parent_client = client
+        self.__hasher = hashlib.sha3_224() # one per article, whether or not its uid is ever asked for
+
+        for source in GARBAGE_SOURCES:
+            if source in self.url:
+                self.title = ""
+                self.image_url = None
+                self.description = ""
+                self.content = ""
+                return
+
+        self.image_url = article_json["urlToImage"]
+        self.title = format_text(article_json["title"]) if article_json["title"] else ""
+        self.description = format_text(article_json["description"]) if article_json["description"] else ""
+        self.content = format_text(article_json["content"]) if article_json["content"] else ""
+
+        self.__proper_nouns_in_title = None
+        self.__proper_nouns_in_description = None
+        self.__all_proper_nouns = None
+        self.__images = OrderedDict() # made up front, whether or not an image is ever fetched
+
+    @property
+    def uid(self):
+        if not (self.title and self.source):
+            return None
+        elif not self.__uid:
+            self.__hasher.update((self.title + self.source).encode(TEXT_ENCODING_FORMAT))
+            self.__uid = self.__hasher.hexdigest()
+
+        return self.__uid
+
+
+def resident_bytes():
+    with open("/proc/self/statm") as f: # linux only
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def bytes_per_article(article_class=NewsArticle, **kwargs):
+    gc.collect()
+    before = resident_bytes()
+    articles = []
+    for i in range(ARTICLE_COUNT):
+        article = article_class(None, make_article_json(i), **kwargs)
+        article.uid # computed once per article, so include it
+        articles.append(article)
+    gc.collect()
+    return (resident_bytes() - before) / ARTICLE_COUNT
+
+
+if __name__ == "__main__":
+    print("__dict__ layout (before):        {:.0f} bytes/article".format(bytes_per_article(DictNewsArticle)))
+    print("NewsArticle:                     {:.0f} bytes/article".format(bytes_per_article()))
+    print("NewsArticle, keep_content=False: {:.0f} bytes/article".format(bytes_per_article(keep_content=False)))
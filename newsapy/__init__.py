@@ -1,4 +1,13 @@
+from newsapy.entity_index import EntityIndex
+from newsapy.image_store import ImageStore
+from newsapy.image_utils import ImageResult
 from newsapy.newsapi_client import NewsApiClient
-from newsapy.newsapi_article import NewsArticle
+from newsapy.newsapi_article import NewsArticle, add_news_signatures
+from newsapy.newsapi_article_batch import NewsArticleBatch
+from newsapy.newsapi_article_export import read_ndjson, read_ndjson_batch, write_ndjson
+from newsapy.newsapi_disk_cache import DiskResponseCache
+from newsapy.newsapi_response_cache import ResponseCache
+from newsapy.newsapi_retry_policy import NewsApiError, RetryPolicy
+from newsapy.near_duplicate_index import NearDuplicateIndex
 from newsapy.proper_noun_extraction import select_better_proper_noun_from
 name = "newsapy"
\ No newline at end of file
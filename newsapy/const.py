@@ -14,18 +14,87 @@ categories = {'business', 'entertainment', 'general', 'health', 'science', 'spor
 sort_method = {'relevancy','popularity','publishedAt'}
 
 HTTP_OK = 200
+HTTP_NOT_MODIFIED = 304
+HTTP_UNAUTHORIZED = 401
+HTTP_TOO_MANY_REQUESTS = 429
+MAX_CONCURRENT_PAGES = 5
 IMAGE_DIRECTORY = "images"
 
+# newsapi_request_scheduler.py
+MAX_REQUESTS_IN_FLIGHT = 20
+PRIORITY_HIGH = 0 # lower numbers are served first
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+ENDPOINT_PRIORITIES = {TOP_HEADLINES_URL: PRIORITY_HIGH, SOURCES_URL: PRIORITY_HIGH, EVERYTHING_URL: PRIORITY_NORMAL}
+
+# newsapi_response_cache.py
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_DEFAULT_TTL_SECONDS = 60
+RESPONSE_CACHE_TTLS = {SOURCES_URL: 6 * 60 * 60, TOP_HEADLINES_URL: 60, EVERYTHING_URL: 5 * 60} # sources barely ever change
+
+# newsapi_disk_cache.py
+DISK_CACHE_DIRECTORY = "newsapi_cache"
+DISK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DISK_CACHE_FILE_EXTENSION = ".json.gz"
+
+# newsapi_key_pool.py
+KEY_COOLDOWN_SECONDS = 60 # how long a ratelimited key rests when NewsAPI doesn't say how long to wait
+RETRY_AFTER_HEADER = "Retry-After"
+RATELIMIT_REMAINING_HEADER = "X-RateLimit-Remaining"
+RATELIMIT_RESET_HEADER = "X-RateLimit-Reset"
+
+# newsapi_retry_policy.py
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_MAX_DELAY_SECONDS = 30
+
 # newsapi_article.py
 NEWS_SIGNATURES = ["| TheHill",  "- CNN", "  Guardian News", "| NYT News - The New York Times", " | NBC Nightly News", " - Bloomberg", " - The Boston Globe", "at CNN.com", "NY POST:", " - Fox News", "Visit MarketsInsider.com …", "Visit Business Insider"]
 IMAGE_URL_FORMAT = "https://res.cloudinary.com/fortitudetec-intern-2019/image/upload/{}.png"
 NEWSAPI_PARSED_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+NEWSAPI_TIME_UNIT = "s" # NewsAPI times are only precise to the second, so numpy times are stored in seconds too
 TEXT_ENCODING_FORMAT = "utf-8"
 
+# newsapi_article_export.py
+EXPORT_CHUNK_SIZE = 1000 # articles encoded per write
+COMPRESSED_FILE_EXTENSION = ".gz" # paths ending in this are gzipped on write and gunzipped on read
+
+# near_duplicate_index.py
+NEAR_DUPLICATE_THRESHOLD = 0.5 # estimated Jaccard similarity of shingles above which two articles are the same story; a re-titled wire story scores about 0.9, one with a differently truncated description about 0.55
+NEAR_DUPLICATE_SHINGLE_SIZE = 2 # words per shingle
+NEAR_DUPLICATE_PERMUTATIONS = 64 # minhashes per article
+NEAR_DUPLICATE_BANDS = 16 # LSH bands the minhashes are split into; more bands catch less similar pairs, at the cost of memory
+NEAR_DUPLICATE_MERGE_SIZE = 65536 # recent band hashes kept in a dict before they're merged into the sorted array
+NEAR_DUPLICATE_SEED = 2019 # fixed, so signatures are comparable between processes
+
+# image_utils.py
+IMAGE_WORKER_THREADS = 8 # threads decoding, resizing and saving images; OpenCV releases the GIL, so they really run in parallel
+MAX_CONCURRENT_IMAGE_DOWNLOADS = 32
+IMAGE_DOWNLOAD_TIMEOUT_SECONDS = 30
+MAX_IMAGE_BYTES = 10 * 1024 ** 2 # downloads are abandoned as soon as they pass this, or announce a Content-Length over it
+MAX_IMAGE_PIXELS = 50 * 1000 ** 2 # images whose header claims more pixels than this aren't downloaded any further
+IMAGE_DOWNLOAD_CHUNK_BYTES = 64 * 1024
+IMAGE_SNIFF_BYTES = 64 * 1024 # how far into a download to look for the image's dimensions before leaving it to the decoder
+IMAGE_CONTENT_TYPES = ("image/", "application/octet-stream", "binary/octet-stream") # content types worth downloading; a missing one is given the benefit of the doubt
+IMAGE_FAILURE_TTL_SECONDS = 60 * 60 # how long a url that answered with a 4xx, or with something that isnt an image, is left alone
+IMAGE_TRANSIENT_FAILURE_TTL_SECONDS = 5 * 60 # the same for timeouts, dropped connections and 5xx/429s, which often clear up
+IMAGE_FAILURE_CACHE_MAX_ENTRIES = 100000
+
+# image_store.py
+IMAGE_STORE_DIRECTORY = "image_store"
+IMAGE_STORE_MAX_BYTES = 2 * 1024 ** 3 # once downloaded images take more than this, the least recently used are deleted
+IMAGE_STORE_EVICT_TO = 0.9 # evict down to this fraction of max_bytes, so eviction doesn't run again on the next image
+IMAGE_STORE_REVALIDATE_SECONDS = 24 * 60 * 60 # how long a stored image is used before asking the server whether it changed
+IMAGE_STORE_INDEX_FILENAME = "index.json"
+IMAGE_STORE_INDEX_SAVE_EVERY = 100 # changes to the index between saves; it's always saved on close
+
 # nltk_handler.py
 TAGGERS = ["maxent_treebank_pos_tagger", "averaged_perceptron_tagger"]
 
 # proper_noun_extraction.py
+PROPER_NOUN_BATCH_SIZE = 64 # texts per executor job when extracting proper nouns in parallel
+PROPER_NOUN_CACHE_MAX_ENTRIES = 100000
+PUNCTUATED_WORD_CACHE_MAX_ENTRIES = 65536
 FAKE_PROPER_NOUNS = ["~", "oh", "*content*", "Factbox", "Explainer", "you're", "Co", "Inc", "Are", "Ldt", "Mr", "Ms", "Mrs", "A", "An", "It", "Here", "How", "Many", "EXCLUSIVE", "v", "-", "Rep", "Sen", "P.M", "A.M", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday", "January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
 JOINERS = ["of"]
 PUNCTUATION_REPLACEMENT = "{}"
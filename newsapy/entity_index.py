@@ -0,0 +1,122 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from itertools import combinations, count
+
+from newsapy.proper_noun_extraction import select_better_proper_noun_from
+
+
+
+class EntityIndex(object):
+    def __init__(self):
+        """
+            Indexes a collection of NewsArticles by the proper nouns they mention.
+
+            Variants of one entity across the corpus ("Trump", "Donald Trump") are folded into a single entity, named
+            by whichever variant select_better_proper_noun_from prefers. Every variant seen is remembered, so looking
+            an entity up by any of them is a dictionary lookup.
+        """
+        self.__entity_names = {} # entity id -> canonical name
+        self.__entity_of_variant = {} # lowercased variant -> entity id
+        self.__entities_by_word = {} # lowercased word of a canonical name -> entity ids
+        self.__articles_of_entity = {} # entity id -> {article key: article}
+        self.__cooccurrences = {} # entity id -> Counter of entity ids mentioned alongside it
+        self.__entities_of_article = {} # article key -> entity ids
+        self.__timeline = [] # sorted (time published, ingestion order, article key) entries
+        self.__next_entity_id = count()
+        self.__ingestion_order = count()
+
+    def add(self, article): # returns False if the article was already in the index
+        article_key = article.uid or article.url # articles without a title dont have a uid
+        if article_key in self.__entities_of_article:
+            return False
+
+        entity_ids = {self.__entity_id_of(proper_noun, create=True) for proper_noun in (article.all_proper_nouns or [])}
+        self.__entities_of_article[article_key] = entity_ids
+        for entity_id in entity_ids:
+            self.__articles_of_entity[entity_id][article_key] = article
+        for first_entity_id, second_entity_id in combinations(entity_ids, 2):
+            self.__cooccurrences[first_entity_id][second_entity_id] += 1
+            self.__cooccurrences[second_entity_id][first_entity_id] += 1
+
+        if article.time_published is not None:
+            insort(self.__timeline, (article.time_published, next(self.__ingestion_order), article_key))
+        return True
+
+    def add_all(self, articles):
+        for article in articles:
+            self.add(article)
+
+    def canonical_name(self, proper_noun): # returns None for entities the index has never seen
+        entity_id = self.__entity_id_of(proper_noun)
+        return None if entity_id is None else self.__entity_names[entity_id]
+
+    def articles_mentioning(self, proper_noun):
+        entity_id = self.__entity_id_of(proper_noun)
+        return [] if entity_id is None else list(self.__articles_of_entity[entity_id].values())
+
+    def top_entities(self, n=10, start=None, end=None):
+        """
+            Returns the n most mentioned entities as (canonical name, number of articles) pairs.
+
+            (datetime) start, end - Only count articles published in [start, end]. Either can be left out.
+        """
+        if start is None and end is None:
+            counts = Counter({entity_id: len(articles) for entity_id, articles in self.__articles_of_entity.items()})
+        else:
+            counts = Counter()
+            first = 0 if start is None else bisect_left(self.__timeline, (start,))
+            last = len(self.__timeline) if end is None else bisect_right(self.__timeline, (end, float("inf")))
+            for _, _, article_key in self.__timeline[first:last]:
+                counts.update(self.__entities_of_article[article_key])
+
+        return [(self.__entity_names[entity_id], mentions) for entity_id, mentions in counts.most_common(n)]
+
+    def cooccurrences(self, proper_noun, n=None): # returns (canonical name, articles mentioning both) pairs, most frequent first
+        entity_id = self.__entity_id_of(proper_noun)
+        if entity_id is None:
+            return []
+        return [(self.__entity_names[other_entity_id], mentions) for other_entity_id, mentions in self.__cooccurrences[entity_id].most_common(n)]
+
+    def __entity_id_of(self, proper_noun, create=False):
+        variant = proper_noun.lower()
+        entity_id = self.__entity_of_variant.get(variant)
+        if entity_id is not None or not create:
+            return entity_id
+
+        candidates = set()
+        for word in variant.split(' '):
+            candidates.update(self.__entities_by_word.get(word, ()))
+        for candidate_id in sorted(candidates): # oldest entity first
+            canonical_variant = self.__entity_names[candidate_id].lower()
+            if variant in canonical_variant or canonical_variant in variant: # a longer or shorter version of an entity we know
+                if select_better_proper_noun_from(variant, canonical_variant) == variant: # and this version makes a better name for it
+                    self.__rename(candidate_id, proper_noun)
+                self.__entity_of_variant[variant] = candidate_id
+                return candidate_id
+
+        entity_id = next(self.__next_entity_id)
+        self.__entity_names[entity_id] = proper_noun
+        self.__entity_of_variant[variant] = entity_id
+        self.__articles_of_entity[entity_id] = {}
+        self.__cooccurrences[entity_id] = Counter()
+        self.__index_words(entity_id)
+        return entity_id
+
+    def __rename(self, entity_id, new_name):
+        for word in self.__entity_names[entity_id].lower().split(' '):
+            entities_with_word = self.__entities_by_word[word]
+            entities_with_word.discard(entity_id)
+            if not entities_with_word:
+                del self.__entities_by_word[word]
+        self.__entity_names[entity_id] = new_name
+        self.__index_words(entity_id)
+
+    def __index_words(self, entity_id):
+        for word in self.__entity_names[entity_id].lower().split(' '):
+            self.__entities_by_word.setdefault(word, set()).add(entity_id)
+
+    def __contains__(self, proper_noun):
+        return self.__entity_id_of(proper_noun) is not None
+
+    def __len__(self): # the number of distinct entities
+        return len(self.__entity_names)
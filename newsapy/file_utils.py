@@ -0,0 +1,22 @@
+import os
+import threading
+
+
+
+def write_atomically(path, data):
+    """
+        Writes bytes to path through a temporary file that's then renamed over it, so nobody reading path ever sees it
+        half-written. The temporary file is named after the process and thread, so writers of the same path at the same
+        time, in this process or another, never write over each other's temporary files.
+    """
+    temporary_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+    except OSError:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from newsapy import const
+from newsapy.file_utils import write_atomically
+from newsapy.newsapi_response_cache import SharedFetch
+
+
+
+class ImageStore(object):
+    def __init__(self, directory=const.IMAGE_STORE_DIRECTORY, max_bytes=const.IMAGE_STORE_MAX_BYTES, revalidate_after=const.IMAGE_STORE_REVALIDATE_SECONDS):
+        """
+            A directory of downloaded images, stored once per distinct content however many urls and articles share them.
+
+            An index maps each url to the hash of its content, along with the ETag and Last-Modified the server sent, so
+            stale images are revalidated with a conditional request instead of downloaded again. Concurrent fetches of one
+            url share a single request. Once the images take more than max_bytes, the least recently used are deleted,
+            along with any resized copies of them recorded with add_files.
+
+            (str) directory - Where the images and index.json are stored. Created if it doesn't exist.
+
+            (int) revalidate_after - Seconds a stored image is trusted before asking the server whether it changed.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.hits = 0
+        self.revalidated = 0 # stale images the server said were still current
+        self.misses = 0
+        self.coalesced = 0
+        self.__urls = {} # url -> {"hash", "etag", "last_modified", "checked_at"}
+        self.__blobs = {} # content hash -> {"size", "last_used", "files": {path of a resized copy: size}}
+        self.__in_flight = {} # url -> SharedFetch of (content hash, image bytes)
+        self.__unsaved_changes = 0
+        self.__saving = False
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.__load_index()
+        self.__total_bytes = sum(blob["size"] + sum(blob.get("files", {}).values()) for blob in self.__blobs.values())
+
+    async def get_or_fetch(self, url, fetch):
+        """
+            Returns (content hash, image bytes) for the url, or None if the server didn't send an image.
+
+            (coroutine function) fetch - fetch(url, headers) returns (status, body, response headers); it's only called
+                                         when the store doesn't have a fresh copy, with conditional headers if it has a stale one.
+        """
+        shared_fetch = self.__in_flight.get(url)
+        if shared_fetch is not None and not shared_fetch.abandoned():
+            self.coalesced += 1
+        else:
+            shared_fetch = SharedFetch(self.__get_or_fetch(url, fetch))
+            shared_fetch.add_done_callback(lambda _: self.__in_flight.pop(url, None) if self.__in_flight.get(url) is shared_fetch else None)
+            self.__in_flight[url] = shared_fetch
+        return await shared_fetch.wait()
+
+    async def __get_or_fetch(self, url, fetch):
+        loop = asyncio.get_event_loop()
+        entry = self.__urls.get(url)
+        content_hash = entry["hash"] if entry and entry["hash"] in self.__blobs else None
+
+        if content_hash is not None and entry["checked_at"] + self.revalidate_after > time.time():
+            data = await loop.run_in_executor(None, self.__read_blob, content_hash)
+            if data is not None:
+                self.hits += 1
+                self.__touch(content_hash)
+                return content_hash, data
+            content_hash = None # deleted from under us
+
+        headers = {}
+        if content_hash is not None: # stale, so ask whether it changed rather than downloading it again
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        status, body, response_headers = await fetch(url, headers)
+
+        if status == const.HTTP_NOT_MODIFIED and content_hash is not None:
+            data = await loop.run_in_executor(None, self.__read_blob, content_hash)
+            if data is not None:
+                self.revalidated += 1
+                entry["checked_at"] = time.time()
+                self.__touch(content_hash)
+                self.__unsaved_changes += 1
+                await self.__save_if_due()
+                return content_hash, data
+            status, body, response_headers = await fetch(url, {}) # the file vanished, so get the image unconditionally
+        if status != const.HTTP_OK or body is None:
+            return None
+
+        self.misses += 1
+        content_hash = hashlib.sha256(body).hexdigest()
+        if content_hash not in self.__blobs: # a new image, rather than one we already have under another url
+            await loop.run_in_executor(None, self.__write_blob, content_hash, body)
+        if content_hash not in self.__blobs: # checked again, since another url with the same image could have been stored meanwhile
+            self.__blobs[content_hash] = {"size": len(body), "last_used": time.time()}
+            self.__total_bytes += len(body)
+        self.__urls[url] = {"hash": content_hash, "etag": response_headers.get("ETag"), "last_modified": response_headers.get("Last-Modified"), "checked_at": time.time()}
+        self.__touch(content_hash)
+        self.__unsaved_changes += 1
+        await self.__evict_if_full()
+        await self.__save_if_due()
+        return content_hash, body
+
+    async def add_files(self, content_hash, paths):
+        """
+            Records files made from a stored image, i.e. its thumbnails, so they count towards max_bytes and are deleted
+            when the image is. Files of an image that has been evicted meanwhile are left alone.
+        """
+        sizes = await asyncio.get_event_loop().run_in_executor(None, _file_sizes, paths)
+        blob = self.__blobs.get(content_hash)
+        if blob is None:
+            return
+        files = blob.setdefault("files", {})
+        for path, size in sizes.items():
+            self.__total_bytes += size - files.get(path, 0) # a file saved again replaces the old one
+            files[path] = size
+        self.__unsaved_changes += 1
+        await self.__evict_if_full()
+
+    async def __evict_if_full(self):
+        if self.__total_bytes > self.max_bytes:
+            await asyncio.get_event_loop().run_in_executor(None, self.__delete, self.__evict())
+
+    def path_of(self, content_hash): # images are spread over 256 subdirectories so no one directory gets huge
+        return os.path.join(self.directory, content_hash[:2], content_hash)
+
+    def __read_blob(self, content_hash):
+        try:
+            with open(self.path_of(content_hash), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def __write_blob(self, content_hash, data):
+        path = self.path_of(content_hash)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomically(path, data) # urls sharing an image can write it at once
+
+    def __touch(self, content_hash):
+        self.__blobs[content_hash]["last_used"] = time.time()
+
+    def __evict(self): # forgets the least recently used images, and returns the paths to delete
+        evicted = set()
+        paths = []
+        for content_hash, blob in sorted(self.__blobs.items(), key=lambda item: item[1]["last_used"]): # least recently used first
+            if self.__total_bytes <= self.max_bytes * const.IMAGE_STORE_EVICT_TO:
+                break
+            files = blob.get("files", {})
+            self.__total_bytes -= blob["size"] + sum(files.values())
+            evicted.add(content_hash)
+            paths.append(self.path_of(content_hash))
+            paths.extend(files)
+
+        for content_hash in evicted:
+            del self.__blobs[content_hash]
+        for url in [url for url, entry in self.__urls.items() if entry["hash"] in evicted]:
+            del self.__urls[url]
+        return paths
+
+    @staticmethod
+    def __delete(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def __save_if_due(self):
+        if self.__unsaved_changes < const.IMAGE_STORE_INDEX_SAVE_EVERY or self.__saving:
+            return
+        self.__saving = True # one save at a time is plenty
+        changes = self.__unsaved_changes
+        self.__unsaved_changes = 0
+        try:
+            index_text = self.__index_text() # serialized here, since the loop keeps changing the index while the executor writes it
+            await asyncio.get_event_loop().run_in_executor(None, self.__write_index, index_text)
+        except OSError: # a full disk shouldn't fail the image fetch; it's tried again after the next change, and on close
+            self.__unsaved_changes += changes
+        finally:
+            self.__saving = False
+
+    def __load_index(self):
+        try:
+            with open(os.path.join(self.directory, const.IMAGE_STORE_INDEX_FILENAME), "r", encoding=const.TEXT_ENCODING_FORMAT) as f:
+                index = json.load(f)
+        except (OSError, ValueError): # a new store, or an index half-written by a worker that died mid-save
+            return
+        self.__urls = index.get("urls", {})
+        self.__blobs = index.get("blobs", {})
+
+    def save(self): # writes the index, so the next process can revalidate instead of downloading everything again
+        self.__unsaved_changes = 0
+        self.__write_index(self.__index_text())
+
+    def __index_text(self):
+        return json.dumps({"urls": self.__urls, "blobs": self.__blobs})
+
+    def __write_index(self, index_text):
+        write_atomically(os.path.join(self.directory, const.IMAGE_STORE_INDEX_FILENAME), index_text.encode(const.TEXT_ENCODING_FORMAT))
+
+    def __contains__(self, url):
+        entry = self.__urls.get(url)
+        return entry is not None and entry["hash"] in self.__blobs
+
+    def __len__(self): # the number of distinct images stored
+        return len(self.__blobs)
+
+    def stats(self):
+        return {"images": len(self.__blobs), "urls": len(self.__urls), "bytes": self.__total_bytes, "hits": self.hits,
+                "revalidated": self.revalidated, "misses": self.misses, "coalesced": self.coalesced}
+
+
+def _file_sizes(paths): # {path: size} of the files that exist
+    sizes = {}
+    for path in paths:
+        try:
+            sizes[path] = os.path.getsize(path)
+        except OSError:
+            pass
+    return sizes
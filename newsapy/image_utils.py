@@ -1,10 +1,29 @@
+import aiohttp
+import asyncio
 import cv2
 import numpy as np
+import os
+import struct
+import time
 
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from newsapy import const
+from newsapy.file_utils import write_atomically
 from PIL import Image # required for opencv, just not openly
 from re import sub
 
 
+
+IMAGE_OK = "ok"
+IMAGE_MISSING = "missing" # the article has no image url, so nothing was fetched
+IMAGE_HTTP_ERROR = "http_error" # the server answered with something other than a 200
+IMAGE_REJECTED = "rejected" # a 200, but too big or not an image at all; see ImagePipeline.__read_image
+IMAGE_DECODE_ERROR = "decode_error" # it looked like an image, but OpenCV couldn't decode it
+IMAGE_TIMEOUT = "timeout"
+IMAGE_CONNECTION_ERROR = "connection_error" # dns failures, refused or dropped connections, and malformed replies
+
+
 # Credit to Django text utils https://github.com/django/django/blob/master/django/utils/text.py
 def get_valid_filename(s):
     s = str(s).strip().replace(' ', '_')
@@ -12,6 +31,39 @@ def get_valid_filename(s):
 
 
 def resize_image(image, dimensions, filename, save_path="images", filetype="png"):
+    return save_image(resize(image, dimensions), filename, save_path=save_path, filetype=filetype)
+
+
+def resize(image, dimensions): # dimensions of None means keep the image as it is
+    if dimensions is None:
+        return image
+    width, height = parse_dimensions(dimensions)
+    if (width, height) == (image.shape[1], image.shape[0]): # shape is (height, width, channels)
+        return image
+    shrinking = width <= image.shape[1] and height <= image.shape[0]
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR) # area averaging doesnt alias when downscaling
+
+
+def resize_all(image, sizes):
+    """
+        Returns {dimensions: image} for every size, largest first. Each size is shrunk from the smallest image already
+        made that's still big enough, rather than from the original every time, so four thumbnails of a photo cost
+        little more than one. A size of None is the original image.
+    """
+    resized = OrderedDict()
+    for dimensions in sorted(set(sizes), key=lambda dimensions: float("-inf") if dimensions is None else -_area(parse_dimensions(dimensions))):
+        if dimensions is None:
+            resized[None] = image
+            continue
+        width, height = parse_dimensions(dimensions)
+        sources = [made for made in resized.values() if made.shape[1] >= width and made.shape[0] >= height]
+        source = min(sources, key=lambda made: made.shape[0] * made.shape[1]) if sources else image
+        resized[dimensions] = resize(source, (width, height))
+
+    return resized
+
+
+def parse_dimensions(dimensions): # (width, height) as ints
     try:
         width = int(dimensions[0])  # dimensions[2] contains channel information, but is ignored by default
         height = int(dimensions[1])
@@ -24,30 +76,425 @@ def resize_image(image, dimensions, filename, save_path="images", filetype="png"
     if width < 1:
         raise ValueError("[ERROR] Non-positive width detected. That image wouldn't be much good.")
 
-    if (width, height) != image.shape[:-1]:  # sometimes this function is called for conversion and naming, not resizing | [:-1] clips the (width, height, channels) tuple to just (width, height)
-        ret = cv2.resize(image, (width, height))
-    else:
-        ret = image
+    return width, height
+
+
+def sized_filename(filename, dimensions): # the naming convention of NewsArticle images, i.e. <uid>_300x200
+    return filename if dimensions is None else filename + "_{}x{}".format(dimensions[0], dimensions[1])
+
+
+def _area(width_and_height):
+    return width_and_height[0] * width_and_height[1]
+
+
+def decode_image(data, largest_size=None):
+    """
+        Decodes downloaded bytes, returning None if they aren't an image OpenCV can read.
+
+        (tuple) largest_size - The biggest (width, height) the image will be shrunk to. If the image is at least twice
+                               that, it's decoded at 1/2, 1/4 or 1/8 scale straight away, which JPEG decodes much faster.
+    """
+    flags = cv2.IMREAD_COLOR
+    sniffed = sniff_image(data) if largest_size is not None else None
+    if sniffed is not None and sniffed[1] is not None:
+        width, height = sniffed[1], sniffed[2]
+        for factor, reduced_flags in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if width // factor >= largest_size[0] and height // factor >= largest_size[1]:
+                flags = reduced_flags
+                break
+
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags) # frombuffer shares the downloaded bytes rather than copying them
+
+
+def sniff_image(data):
+    """
+        Looks at the first bytes of a file for an image format OpenCV reads, and the dimensions in its header.
+        Returns (format, width, height), with width and height None if they aren't within data, or None if data doesn't
+        start like an image at all (i.e. an HTML error page or a video).
+    """
+    if data[:3] == b"\xff\xd8\xff":
+        return ("jpeg",) + _jpeg_dimensions(data)
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ("png",) + (struct.unpack(">II", data[16:24]) if len(data) >= 24 else (None, None))
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return ("gif",) + (struct.unpack("<HH", data[6:10]) if len(data) >= 10 else (None, None))
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ("webp",) + _webp_dimensions(data)
+    if data[:2] == b"BM":
+        return ("bmp",) + ((struct.unpack("<i", data[18:22])[0], abs(struct.unpack("<i", data[22:26])[0])) if len(data) >= 26 else (None, None)) # bmp heights are negative for top-down images
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff", None, None
+    return None
+
+
+def _jpeg_dimensions(data): # walks the segments up to the first start-of-frame, which holds the dimensions
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None, None # not a well-formed jpeg; let the decoder decide
+        marker = data[i + 1]
+        if marker == 0xFF: # padding
+            i += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC): # SOFn, not DHT/JPG/DAC
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None, None
+
+
+def _webp_dimensions(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None, None
 
-    save_filename = save_path + "/" + get_valid_filename(filename) + ".{}".format(filetype)
-    cv2.imwrite(save_filename, ret)
 
+def save_image(image, filename, save_path="images", filetype="png"):
+    save_filename = _image_path(filename, save_path, filetype)
+    succeeded, encoded = cv2.imencode(".{}".format(filetype), image)
+    if not succeeded:
+        raise ValueError("[ERROR] OpenCV couldn't encode the image as {}.".format(filetype))
+
+    write_atomically(save_filename, encoded.data)
     return save_filename
 
 
-async def fetch_and_resize_image(session, url, filename, save_path="images", dimensions=None): # WORKS but slow for inexplicable reasons
-    try:
-        async with session.get(url) as image_response:
-            if image_response.status == 200:
-                image_array = np.asarray(bytearray(await image_response.read()), dtype="uint8") # create a numpy array from the byte array we get from reading the stream, where the data in the array is uint8's
-                image = cv2.imdecode(image_array, cv2.IMREAD_COLOR) #BREAKABLE
-
-                if not dimensions: # if we werent told to resize the image:
-                    dimensions = image.shape # use the filetype and naming convention of resize_image without actually resizing
-                image = resize_image(image, dimensions, filename, save_path=save_path, filetype="jpeg") # get the last part (image name) of the url
-                return image
-
-            else:
-                return image_response #DEBUGGING
-    except Exception as e:
-        return e #DEBUGGING
+def _image_path(filename, save_path, filetype):
+    return save_path + "/" + get_valid_filename(filename) + ".{}".format(filetype)
+
+
+def decode_resize_and_save(data, dimensions, filename, save_path="images", filetype="jpeg"): # one job for the pipeline's threads, so an image only crosses threads once
+    image = decode_image(data)
+    if image is None:
+        return None
+    return save_image(resize(image, dimensions), filename, save_path=save_path, filetype=filetype)
+
+
+def read_resize_and_save(path, dimensions, filename, save_path="images", filetype="png"):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return save_image(resize(image, dimensions), filename, save_path=save_path, filetype=filetype)
+
+
+def decode_and_resize_all(data, sizes): # None if the bytes aren't an image
+    largest_size = None
+    if None not in sizes: # nobody wants the full-sized image, so it can be decoded at a reduced size
+        widths_and_heights = [parse_dimensions(dimensions) for dimensions in sizes]
+        largest_size = (max(width for width, _ in widths_and_heights), max(height for _, height in widths_and_heights))
+    image = decode_image(data, largest_size)
+    return None if image is None else resize_all(image, sizes)
+
+
+def read_and_resize_all(path, sizes):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    return None if image is None else resize_all(image, sizes)
+
+
+class ImageFetchError(Exception): # raised by ImagePipeline for images that cant be had; network errors are raised as they are
+    def __init__(self, message, outcome, status=None):
+        super(ImageFetchError, self).__init__(message)
+        self.outcome = outcome # one of IMAGE_HTTP_ERROR, IMAGE_REJECTED or IMAGE_DECODE_ERROR
+        self.status = status
+
+
+class ImageResult(object):
+    __slots__ = ("outcome", "url", "paths", "status", "reason", "cached")
+
+    def __init__(self, outcome, url, paths=None, status=None, reason=None, cached=False):
+        """
+            What happened when an image was fetched, so callers can tell a dead link from a timeout without catching anything.
+
+            (str) outcome - IMAGE_OK, or which way it failed: IMAGE_HTTP_ERROR, IMAGE_REJECTED, IMAGE_DECODE_ERROR, IMAGE_TIMEOUT,
+                            IMAGE_CONNECTION_ERROR, or IMAGE_MISSING if there was no url to fetch.
+
+            (dict) paths - {dimensions: path} of every size saved, if it worked.
+
+            (bool) cached - The url failed recently, so this failure was remembered rather than fetched again.
+        """
+        self.outcome = outcome
+        self.url = url
+        self.paths = paths
+        self.status = status # the HTTP status, for http errors
+        self.reason = reason
+        self.cached = cached
+
+    @property
+    def ok(self):
+        return self.outcome == IMAGE_OK
+
+    @property
+    def path(self): # the path of the first size, which is the only one for single-size fetches
+        return next(iter(self.paths.values())) if self.paths else None
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return "ImageResult({!r}, {!r}, status={!r}, reason={!r}, cached={!r})".format(self.outcome, self.url, self.status, self.reason, self.cached)
+
+
+class ImageFailureCache(object):
+    def __init__(self, max_entries=const.IMAGE_FAILURE_CACHE_MAX_ENTRIES, ttl=const.IMAGE_FAILURE_TTL_SECONDS,
+                 transient_ttl=const.IMAGE_TRANSIENT_FAILURE_TTL_SECONDS):
+        """
+            Remembers image urls that failed, so they aren't downloaded again on every call while they're still broken.
+
+            (int) ttl - Seconds to remember 4xxs, rejected bodies and undecodable images; 0 doesn't remember them.
+
+            (int) transient_ttl - The same for timeouts, connection errors, 5xxs and 429s, which are more likely to clear up.
+        """
+        if max_entries < 1:
+            raise ValueError("[ERROR] max_entries should be at least 1.")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.transient_ttl = transient_ttl
+        self.__entries = OrderedDict() # url -> (expiry time, ImageResult), oldest first
+
+    def get(self, url): # the remembered failure, or None
+        entry = self.__entries.get(url)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self.__entries[url]
+            return None
+        return ImageResult(result.outcome, url, status=result.status, reason=result.reason, cached=True)
+
+    def put(self, result):
+        ttl = self.transient_ttl if _is_transient(result) else self.ttl
+        if ttl <= 0:
+            return
+        self.__entries.pop(result.url, None)
+        self.__entries[result.url] = (time.monotonic() + ttl, result)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def discard(self, url):
+        self.__entries.pop(url, None)
+
+    def clear(self):
+        self.__entries.clear()
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+def _is_transient(result):
+    if result.outcome in (IMAGE_TIMEOUT, IMAGE_CONNECTION_ERROR):
+        return True
+    return result.outcome == IMAGE_HTTP_ERROR and result.status is not None and (result.status >= 500 or result.status == const.HTTP_TOO_MANY_REQUESTS)
+
+
+class ImagePipeline(object):
+    def __init__(self, session, executor=None, max_concurrent_downloads=const.MAX_CONCURRENT_IMAGE_DOWNLOADS, image_store=None,
+                 max_image_bytes=const.MAX_IMAGE_BYTES, max_image_pixels=const.MAX_IMAGE_PIXELS, failure_cache=None):
+        """
+            Downloads, decodes, resizes and saves images without holding up the event loop.
+
+            At most max_concurrent_downloads images are downloaded at once. Decoding, resizing, encoding and writing each
+            image to disk are a single job on the executor, so hundreds of images keep every worker busy while the event
+            loop only ever waits on the network.
+
+            (executor) executor - Where the CPU and disk work runs. Defaults to a pool of const.IMAGE_WORKER_THREADS
+                                  threads, which the pipeline owns and shuts down in close().
+
+            (int) max_image_bytes, max_image_pixels - Downloads bigger than these are abandoned early; see __read_image.
+
+            (ImageStore) image_store - Downloads go through it, so each url is fetched once and revalidated after that.
+                                       Saved images are then named after the image's content hash instead of filename,
+                                       so articles sharing an image share its files, and sizes already on disk are reused.
+                                       The saved sizes count towards the store's max_bytes, and are evicted with the image.
+
+            (ImageFailureCache) failure_cache - Where fetch_image remembers urls that failed. Defaults to a new one.
+        """
+        self.session = session
+        self.__owns_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=const.IMAGE_WORKER_THREADS, thread_name_prefix="newsapy-images")
+        self.__download_slots = asyncio.Semaphore(max_concurrent_downloads)
+        self.image_store = image_store
+        self.max_image_bytes = max_image_bytes
+        self.max_image_pixels = max_image_pixels
+        self.__in_progress = {} # (content hash, sizes, save path, filetype) -> future of the paths being made
+        self.failure_cache = failure_cache if failure_cache is not None else ImageFailureCache()
+        self.outcomes = Counter() # outcome -> number of fetch_image calls that ended that way, remembered failures included
+        self.failures_remembered = 0 # fetch_image calls answered from failure_cache without touching the network
+
+    async def fetch_image(self, url, filename, sizes, save_path="images", filetype="jpeg"):
+        """
+            Like fetch_and_resize_all, but returns an ImageResult instead of raising when the image can't be had, with
+            its paths set if it worked. Urls that failed are skipped until their failure_cache entry expires, and get
+            the same result back straight away.
+        """
+        result = self.failure_cache.get(url)
+        if result is not None:
+            self.failures_remembered += 1
+        else:
+            try:
+                result = ImageResult(IMAGE_OK, url, paths=await self.fetch_and_resize_all(url, filename, sizes, save_path=save_path, filetype=filetype))
+            except ImageFetchError as e:
+                result = ImageResult(e.outcome, url, status=e.status, reason=str(e))
+            except asyncio.TimeoutError: # before ClientError, since aiohttp's own timeouts are both
+                result = ImageResult(IMAGE_TIMEOUT, url, reason="[ERROR] No image from {} within {} seconds.".format(url, const.IMAGE_DOWNLOAD_TIMEOUT_SECONDS))
+            except aiohttp.ClientError as e:
+                result = ImageResult(IMAGE_CONNECTION_ERROR, url, reason="[ERROR] {}: {}".format(type(e).__name__, e))
+            if not result.ok:
+                self.failure_cache.put(result)
+
+        self.outcomes[result.outcome] += 1
+        return result
+
+    async def fetch_and_resize(self, url, filename, save_path="images", dimensions=None, filetype="jpeg"):
+        """
+            Returns the path the image was saved to. Raises ImageFetchError if the server didn't send back an image, and
+            aiohttp.ClientError or asyncio.TimeoutError for network errors.
+        """
+        return (await self.fetch_and_resize_all(url, filename, [dimensions], save_path=save_path, filetype=filetype))[dimensions]
+
+    async def fetch_and_resize_all(self, url, filename, sizes, save_path="images", filetype="jpeg"):
+        """
+            Downloads and decodes the image once, and saves it in every size, named like sized_filename.
+            Returns {dimensions: path}, with None for the original size if it was asked for. Raises like fetch_and_resize.
+        """
+        content_hash, data = await self.__download(url)
+        if content_hash is None:
+            return await self.__decode_and_save_all(data, sizes, filename, save_path, filetype)
+
+        paths = OrderedDict((dimensions, _image_path(sized_filename(content_hash, dimensions), save_path, filetype)) for dimensions in sizes)
+        if all(os.path.exists(path) for path in paths.values()): # another article with the same image already made these
+            return paths
+        key = (content_hash, tuple(sizes), save_path, filetype)
+        if key not in self.__in_progress: # articles sharing an image at the same time share one decode
+            self.__in_progress[key] = asyncio.ensure_future(self.__save_stored_image(data, sizes, content_hash, save_path, filetype))
+            self.__in_progress[key].add_done_callback(lambda _: self.__in_progress.pop(key, None))
+        return await asyncio.shield(self.__in_progress[key])
+
+    async def __save_stored_image(self, data, sizes, content_hash, save_path, filetype): # the sizes are recorded with the store, so its eviction covers them too
+        paths = await self.__decode_and_save_all(data, sizes, content_hash, save_path, filetype)
+        await self.image_store.add_files(content_hash, paths.values())
+        return paths
+
+    async def __decode_and_save_all(self, data, sizes, filename, save_path, filetype):
+        images = await asyncio.get_event_loop().run_in_executor(self.executor, decode_and_resize_all, data, sizes)
+        if images is None:
+            raise ImageFetchError("[ERROR] {} bytes that start like an image, but OpenCV couldn't decode them.".format(len(data)), IMAGE_DECODE_ERROR)
+        return await self.__save_all(images, filename, save_path, filetype)
+
+    async def resize_file_all(self, path, sizes, filename, save_path="images", filetype="jpeg"): # like fetch_and_resize_all, for an image already on disk
+        return await self.__save_all(await asyncio.get_event_loop().run_in_executor(self.executor, read_and_resize_all, path, sizes), filename, save_path, filetype)
+
+    async def __save_all(self, images, filename, save_path, filetype):
+        if images is None:
+            return None
+        loop = asyncio.get_event_loop()
+        paths = await asyncio.gather(*[loop.run_in_executor(self.executor, save_image, image, sized_filename(filename, dimensions), save_path, filetype)
+                                       for dimensions, image in images.items()]) # encoding is the slow part, so every size gets its own worker
+        return OrderedDict(zip(images, paths))
+
+    async def download(self, url): # the body of the image; raises like fetch_and_resize
+        return (await self.__download(url))[1]
+
+    async def __download(self, url): # (content hash if its in the image store, body)
+        if self.image_store is None:
+            _, body, _ = await self.__get(url, {})
+            return None, body
+        stored = await self.image_store.get_or_fetch(url, self.__get)
+        if stored is None: # only when the server answered a revalidation with a 304 for an image the store no longer has
+            raise ImageFetchError("[ERROR] {} answered with a 304 to an unconditional request.".format(url), IMAGE_HTTP_ERROR, status=const.HTTP_NOT_MODIFIED)
+        return stored
+
+    async def __get(self, url, headers): # (status, body, response headers); the body is only None for a 304
+        async with self.__download_slots:
+            async with self.session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=const.IMAGE_DOWNLOAD_TIMEOUT_SECONDS)) as image_response:
+                if image_response.status == const.HTTP_NOT_MODIFIED and headers:
+                    return image_response.status, None, image_response.headers
+                if image_response.status != const.HTTP_OK:
+                    raise ImageFetchError("[ERROR] {} answered with a {}.".format(url, image_response.status), IMAGE_HTTP_ERROR, status=image_response.status)
+                return image_response.status, await self.__read_image(image_response), image_response.headers
+
+    async def __read_image(self, image_response):
+        """
+            Streams the body in chunks, giving up (and raising ImageFetchError) as soon as it's clearly not something worth
+            having: a Content-Length or Content-Type that rules it out, bytes that don't start like an image, a header
+            claiming more than max_image_pixels, or a body growing past max_image_bytes. Dropping the connection saves the rest.
+        """
+        if image_response.content_length is not None and image_response.content_length > self.max_image_bytes:
+            raise _rejected("a Content-Length of {} bytes, over max_image_bytes".format(image_response.content_length))
+        content_type = image_response.headers.get("Content-Type", "").lower()
+        if content_type and not content_type.startswith(const.IMAGE_CONTENT_TYPES):
+            raise _rejected("a Content-Type of {}".format(content_type))
+
+        body = bytearray()
+        sniffed = False # whether the format and dimensions have been checked
+        async for chunk in image_response.content.iter_chunked(const.IMAGE_DOWNLOAD_CHUNK_BYTES):
+            body += chunk
+            if len(body) > self.max_image_bytes:
+                raise _rejected("a body of over {} bytes, max_image_bytes".format(self.max_image_bytes))
+            if not sniffed and len(body) >= 32: # enough for every format's magic bytes
+                image_header = sniff_image(body)
+                if image_header is None:
+                    raise _rejected("a body that doesn't start like an image")
+                if image_header[1] is not None: # the dimensions were in the bytes so far
+                    if image_header[1] * image_header[2] > self.max_image_pixels:
+                        raise _rejected("a {}x{} {}, over max_image_pixels".format(*image_header[1:], image_header[0]))
+                    sniffed = True
+                elif len(body) >= const.IMAGE_SNIFF_BYTES: # leave it to the decoder
+                    sniffed = True
+
+        if not sniffed and sniff_image(body) is None: # a body too short to have been checked on the way
+            raise _rejected("a body that doesn't start like an image")
+        return bytes(body)
+
+    async def resize_file(self, path, dimensions, filename, save_path="images", filetype="png"): # makes another size of an image already on disk
+        return await asyncio.get_event_loop().run_in_executor(self.executor, read_resize_and_save, path, dimensions, filename, save_path, filetype)
+
+    def stats(self):
+        return {"outcomes": dict(self.outcomes), "failures_remembered": self.failures_remembered, "failed_urls": len(self.failure_cache)}
+
+    def close(self):
+        if self.__owns_executor:
+            self.executor.shutdown(wait=False)
+
+
+def _rejected(what):
+    return ImageFetchError("[ERROR] The server sent {}.".format(what), IMAGE_REJECTED)
+
+
+async def fetch_and_resize_image(session, url, filename, save_path="images", dimensions=None): # kept for callers without a pipeline; returns an ImageResult
+    return await _default_pipeline(session).fetch_image(url, filename, [dimensions], save_path=save_path)
+
+
+def _default_pipeline(session): # shared, so max_concurrent_downloads holds across calls; remade only for a different session
+    global _shared_pipeline
+    if _shared_pipeline is None or _shared_pipeline.session is not session:
+        _shared_pipeline = ImagePipeline(session, executor=_default_executor(), failure_cache=_default_failure_cache())
+    return _shared_pipeline
+
+
+def _default_executor():
+    global _shared_executor
+    if _shared_executor is None:
+        _shared_executor = ThreadPoolExecutor(max_workers=const.IMAGE_WORKER_THREADS, thread_name_prefix="newsapy-images")
+    return _shared_executor
+
+
+def _default_failure_cache(): # shared, so callers of fetch_and_resize_image skip urls that failed for each other, whatever their session
+    global _shared_failure_cache
+    if _shared_failure_cache is None:
+        _shared_failure_cache = ImageFailureCache()
+    return _shared_failure_cache
+
+
+_shared_executor = None
+_shared_failure_cache = None
+_shared_pipeline = None
@@ -0,0 +1,135 @@
+import numpy as np
+import re
+import zlib
+
+from newsapy import const
+
+
+
+_MERSENNE_PRIME = (1 << 31) - 1 # minhashes are (a * crc32 + b) mod this, which never overflows 64 bits
+_BAND_HASH_MULTIPLIER = np.uint64(0x100000001B3) # FNV-1a's prime; band hashes are allowed to wrap around
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class NearDuplicateIndex(object):
+    def __init__(self, threshold=const.NEAR_DUPLICATE_THRESHOLD, shingle_size=const.NEAR_DUPLICATE_SHINGLE_SIZE,
+                 permutations=const.NEAR_DUPLICATE_PERMUTATIONS, bands=const.NEAR_DUPLICATE_BANDS):
+        """
+            Clusters NewsArticles that tell the same story, i.e. one wire story republished by forty outlets with
+            slightly different titles, so everything after the first can be skipped.
+
+            Each article's title and description are cut into word shingles and summarised by a MinHash signature.
+            Signatures are split into bands and only articles sharing a band with a known story are compared, so
+            looking up an article stays cheap however many stories are indexed. Only the first article of each story
+            is indexed.
+
+            Band hashes live in one sorted NumPy array, with the newest in a small dict that's merged into it every so
+            often, so a story costs about 500 bytes on top of its article rather than a few kilobytes of dict entries.
+
+            (float) threshold - The estimated Jaccard similarity at which two articles count as the same story.
+
+            (int) shingle_size - Words per shingle.
+
+            (int) permutations, bands - Signature length, and how many bands it's split into. Must divide evenly.
+        """
+        if permutations % bands:
+            raise ValueError("[ERROR] permutations should be a multiple of bands.")
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = permutations // bands
+        self.duplicates = 0 # articles found to be a story already in the index
+
+        random_state = np.random.RandomState(const.NEAR_DUPLICATE_SEED)
+        self.__a = random_state.randint(1, _MERSENNE_PRIME, size=permutations).astype(np.uint64)
+        self.__b = random_state.randint(0, _MERSENNE_PRIME, size=permutations).astype(np.uint64)
+        self.__signatures = np.empty((1024, permutations), dtype=np.uint32) # story id -> signature, grown by doubling
+        self.__originals = [] # story id -> the first article seen of it
+        self.__story_sizes = [] # story id -> articles seen of it
+        self.__band_salts = random_state.randint(0, 1 << 62, size=bands).astype(np.uint64) # so equal bands in different positions hash differently
+        self.__band_hashes_sorted = np.empty(0, dtype=np.uint64) # every indexed band hash, sorted
+        self.__story_ids_sorted = np.empty(0, dtype=np.uint32) # the story each of those belongs to
+        self.__recent_band_hashes = {} # band hash -> story id, for stories not merged into the arrays yet
+
+    def add(self, article): # returns the article this one duplicates, or None if it's a new story (which is then indexed)
+        signature = self.signature(article)
+        if signature is None: # no text to compare, i.e. garbage sources
+            return None
+
+        story_id = self.__find(signature)
+        if story_id is not None:
+            self.duplicates += 1
+            self.__story_sizes[story_id] += 1
+            return self.__originals[story_id]
+
+        story_id = len(self.__originals)
+        if story_id == len(self.__signatures):
+            self.__signatures = np.concatenate([self.__signatures, np.empty_like(self.__signatures)])
+        self.__signatures[story_id] = signature
+        self.__originals.append(article)
+        self.__story_sizes.append(1)
+        for band_hash in self.__band_hashes(signature).tolist():
+            self.__recent_band_hashes.setdefault(band_hash, story_id) # the older story keeps a shared band
+        if len(self.__recent_band_hashes) >= max(const.NEAR_DUPLICATE_MERGE_SIZE, len(self.__band_hashes_sorted) // 4): # merging costs a pass over the arrays, so do it less as they grow
+            self.__merge_recent_band_hashes()
+        return None
+
+    def find(self, article): # like add, without adding anything
+        signature = self.signature(article)
+        story_id = None if signature is None else self.__find(signature)
+        return None if story_id is None else self.__originals[story_id]
+
+    def unique(self, articles): # yields the articles that aren't duplicates of one already seen, adding all of them
+        for article in articles:
+            if self.add(article) is None:
+                yield article
+
+    def story_size(self, article): # how many articles of this article's story have been added
+        signature = self.signature(article)
+        story_id = None if signature is None else self.__find(signature)
+        return 0 if story_id is None else self.__story_sizes[story_id]
+
+    def signature(self, article):
+        words = _WORD_PATTERN.findall("{} {}".format(article.title, article.description or "").lower())
+        if not words:
+            return None
+
+        shingles = [" ".join(words[i:i + self.shingle_size]) for i in range(max(1, len(words) - self.shingle_size + 1))]
+        shingle_hashes = np.fromiter((zlib.crc32(shingle.encode(const.TEXT_ENCODING_FORMAT)) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        return ((shingle_hashes[:, None] * self.__a + self.__b) % _MERSENNE_PRIME).min(axis=0).astype(np.uint32) # every permutation at once
+
+    def __find(self, signature):
+        band_hashes = self.__band_hashes(signature)
+        candidates = {self.__recent_band_hashes.get(band_hash) for band_hash in band_hashes.tolist()}
+        candidates.discard(None)
+        positions = np.searchsorted(self.__band_hashes_sorted, band_hashes) # the first (oldest) entry of each band hash, if it's there
+        found = positions < len(self.__band_hashes_sorted)
+        found[found] = self.__band_hashes_sorted[positions[found]] == band_hashes[found]
+        candidates.update(self.__story_ids_sorted[positions[found]].tolist())
+        if not candidates:
+            return None
+
+        candidates = list(candidates)
+        similarities = (self.__signatures[candidates] == signature).mean(axis=1) # the share of matching minhashes estimates the Jaccard similarity
+        best = int(np.argmax(similarities))
+        return candidates[best] if similarities[best] >= self.threshold else None
+
+    def __band_hashes(self, signature): # one uint64 per band
+        band_hashes = self.__band_salts.copy()
+        for row in signature.reshape(self.bands, self.rows).T.astype(np.uint64): # every band at once, a row at a time
+            band_hashes = band_hashes * _BAND_HASH_MULTIPLIER ^ row
+        return band_hashes
+
+    def __merge_recent_band_hashes(self):
+        band_hashes = np.concatenate([self.__band_hashes_sorted, np.fromiter(self.__recent_band_hashes.keys(), dtype=np.uint64, count=len(self.__recent_band_hashes))])
+        story_ids = np.concatenate([self.__story_ids_sorted, np.fromiter(self.__recent_band_hashes.values(), dtype=np.uint32, count=len(self.__recent_band_hashes))])
+        order = np.argsort(band_hashes, kind="stable") # stable, so older stories stay first among equal band hashes
+        self.__band_hashes_sorted = band_hashes[order]
+        self.__story_ids_sorted = story_ids[order]
+        self.__recent_band_hashes.clear()
+
+    def __len__(self): # the number of distinct stories
+        return len(self.__originals)
+
+    def stats(self):
+        return {"stories": len(self.__originals), "duplicates": self.duplicates}
@@ -1,45 +1,115 @@
-import cv2
 import hashlib
 import json
+import numpy as np
+import os
+import re
 
-from newsapy import image_utils
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import OrderedDict
-from newsapy.const import NEWS_SIGNATURES, GARBAGE_SOURCES, TEXT_ENCODING_FORMAT, IMAGE_URL_FORMAT, NEWSAPI_PARSED_TIME_FORMAT
-from newsapy.proper_noun_extraction import extract_proper_nouns_from_text, select_better_proper_noun_from
+from sys import intern
+from newsapy.const import NEWS_SIGNATURES, GARBAGE_SOURCES, TEXT_ENCODING_FORMAT, IMAGE_URL_FORMAT, NEWSAPI_PARSED_TIME_FORMAT, NEWSAPI_TIME_UNIT
+from newsapy.image_utils import IMAGE_DECODE_ERROR, IMAGE_MISSING, IMAGE_OK, ImageResult
+from newsapy.proper_noun_extraction import ProperNounMerger, extract_proper_nouns_batch, extract_proper_nouns_from_text
 
 class NewsArticle(object):
-    def __init__(self, client, article_json, force_initialize_proper_nouns=False, force_initialize_images=False):
+    # slots instead of a __dict__, since corpora of hundreds of thousands of articles are held in memory at once.
+    # a typical article with its uid computed keeps about 1,030 bytes alive (780 with keep_content=False), down from
+    # about 1,800 with a __dict__ and a hasher per article; see benchmarks/article_memory.py
+    __slots__ = ("id", "source", "authors", "url", "__time_published", "__title", "__description", "__content", "__image_url", "__article_json",
+                 "__uid", "__parent_client", "__proper_nouns_in_title", "__proper_nouns_in_description", "__all_proper_nouns", "__images")
+
+    def __init__(self, client, article_json, force_initialize_proper_nouns=False, force_initialize_images=False, keep_content=True, lazy=False):
+        """
+            (bool) lazy - Hold on to article_json and only format the title, description, content and image url the first
+                          time one of them is asked for. Much cheaper for articles that get filtered out by url, source or
+                          time first, but the whole json is kept alive until then.
+        """
         self.__uid = None # used in some databases
         self.id = None # used for UID in some applications after fetching
-        self.source = article_json["source"]["name"]
+        self.source = intern(article_json["source"]["name"]) if article_json["source"]["name"] else article_json["source"]["name"] # a handful of source names are shared by every article
         self.authors = article_json["author"]
         self.url = article_json["url"]
-        self.time_published = parse_newsapi_time(article_json["publishedAt"])
+        self.__time_published = article_json["publishedAt"] # the raw string until time_published is first asked for
         self.__parent_client = client
-        self.__hasher = hashlib.sha3_224()
-
-        for source in GARBAGE_SOURCES:
-            if source in self.url:
-                self.title = ""
-                self.image_url = None
-                self.description = ""
-                self.content = ""
-                return
-
-        self.image_url = article_json["urlToImage"]
-        self.title = format_text(article_json["title"]) if article_json["title"] else ""
-        self.description = format_text(article_json["description"]) if article_json["description"] else ""
-        self.content = format_text(article_json["content"]) if article_json["content"] else ""
-
         self.__proper_nouns_in_title = None
         self.__proper_nouns_in_description = None
         self.__all_proper_nouns = None
+        self.__images = None # an OrderedDict once an image is fetched; always stores the full-sized image first, if it was made
+        self.__content = None if keep_content else "" # content is rarely used, and the biggest field by far
+        self.__article_json = article_json # until the text fields are formatted
+        if not lazy:
+            self.__format_text_fields()
+
         if force_initialize_proper_nouns: # these "properties" are actually lazy methods; setting FIPN forces them to evaluate immediately
             self.__proper_nouns_in_title = self.proper_nouns_in_title
             self.__proper_nouns_in_description = self.proper_nouns_in_description
             self.__all_proper_nouns = self.all_proper_nouns
-        self.__images = OrderedDict() # always stores the full-sized image first
+
+    def __format_text_fields(self): # fills in the title, description, content and image url, then lets go of the article json
+        article_json = self.__article_json
+        self.__article_json = None
+
+        for source in GARBAGE_SOURCES:
+            if source in self.url:
+                self.__title = ""
+                self.__image_url = None
+                self.__description = ""
+                self.__content = ""
+                return
+
+        self.__image_url = article_json["urlToImage"]
+        self.__title = format_text(article_json["title"]) if article_json["title"] else ""
+        self.__description = format_text(article_json["description"]) if article_json["description"] else ""
+        if self.__content is None: # otherwise keep_content was False
+            self.__content = format_text(article_json["content"]) if article_json["content"] else ""
+
+    @property
+    def title(self):
+        if self.__article_json is not None: # a lazy article that hasnt been formatted yet
+            self.__format_text_fields()
+        return self.__title
+
+    @title.setter
+    def title(self, title):
+        if self.__article_json is not None:
+            self.__format_text_fields()
+        self.__title = title
+
+    @property
+    def description(self):
+        if self.__article_json is not None:
+            self.__format_text_fields()
+        return self.__description
+
+    @description.setter
+    def description(self, description):
+        if self.__article_json is not None:
+            self.__format_text_fields()
+        self.__description = description
+
+    @property
+    def content(self):
+        if self.__article_json is not None:
+            self.__format_text_fields()
+        return self.__content
+
+    @content.setter
+    def content(self, content):
+        if self.__article_json is not None:
+            self.__format_text_fields()
+        self.__content = content
+
+    @property
+    def image_url(self):
+        if self.__article_json is not None:
+            self.__format_text_fields()
+        return self.__image_url
+
+    @image_url.setter
+    def image_url(self, image_url):
+        if self.__article_json is not None:
+            self.__format_text_fields()
+        self.__image_url = image_url
 
     @property
     def proper_nouns_in_title(self):
@@ -61,63 +131,96 @@ class NewsArticle(object):
 
         return self.__proper_nouns_in_description
 
+    def set_proper_nouns(self, proper_nouns_in_title, proper_nouns_in_description): # fills the lazy caches with nouns extracted elsewhere, i.e. in a batch
+        self.__proper_nouns_in_title = proper_nouns_in_title
+        self.__proper_nouns_in_description = proper_nouns_in_description
+        self.__all_proper_nouns = None # has to be recomputed from the new lists
+
     @property
     def all_proper_nouns(self):
         if self.title == "" and self.description == "":
             return None
         if self.__all_proper_nouns is None: # if we havent already computed the list, do it now
-            ret = set()
-            proper_nouns = list(set().union(self.proper_nouns_in_title, self.proper_nouns_in_description)) # the non-repetitive union of two sets of proper nouns
-            for first_proper_noun in proper_nouns:
-                to_add = first_proper_noun
-                marked_for_removal_from_ret = []
-                for second_proper_noun in ret:
-                    if first_proper_noun in second_proper_noun or second_proper_noun in first_proper_noun: # if this proper noun is a smaller version of another one later in the list
-                        to_add = select_better_proper_noun_from(first_proper_noun, second_proper_noun)
-                        if not to_add == second_proper_noun:
-                            marked_for_removal_from_ret.append(second_proper_noun)
-
-                for subsumed_noun in marked_for_removal_from_ret:
-                    ret.remove(subsumed_noun)
-                ret.add(to_add)
-
-            self.__all_proper_nouns = list(ret) # set the property so we only have to compute it once
+            merger = ProperNounMerger(case_sensitive=True)
+            for proper_noun in set().union(self.proper_nouns_in_title, self.proper_nouns_in_description): # the non-repetitive union of two sets of proper nouns
+                merger.add(proper_noun) # smaller versions of other proper nouns get merged into them
+
+            self.__all_proper_nouns = merger.proper_nouns() # set the property so we only have to compute it once
 
         return self.__all_proper_nouns
 
+    @property
+    def time_published(self): # a naive datetime in UTC, or None if NewsAPI didn't give one
+        if isinstance(self.__time_published, str): # parsed lazily, since plenty of articles are filtered out before anyone looks at their time
+            self.__time_published = parse_newsapi_time(self.__time_published)
+
+        return self.__time_published
+
+    @time_published.setter
+    def time_published(self, time_published):
+        self.__time_published = time_published
+
     @property
     def uid(self):
         if not (self.title and self.source): # since the hash is a combination of these two, we cant make one without them
             return None
         elif not self.__uid:
-            self.__hasher.update((self.title + self.source).encode(TEXT_ENCODING_FORMAT))
-            self.__uid = self.__hasher.hexdigest()
+            self.__uid = hashlib.sha3_224((self.title + self.source).encode(TEXT_ENCODING_FORMAT)).hexdigest()
 
         return self.__uid
 
     async def image_async(self, save_path="images", dimensions=None):
-        if dimensions:
-            filename = self.uid + "_{}x{}".format(dimensions[0], dimensions[1])
-        else:
-            filename = self.uid
-        img_path = None
-
         if self.image_url is None:
             return None
-        elif not self.__images: # if we havent fetched the image for this article yet
-            img_path = await image_utils.fetch_and_resize_image(self.__parent_client.http_session, self.image_url, filename, save_path=save_path) # download the full-sized image
-        elif not dimensions: # if weve fetched it, and no specific dims were requested
+        elif self.__images and not dimensions: # if weve fetched it, and no specific dims were requested
             return self.title, list(self.__images.values())[-1]  # return the most recently fetched image
-        elif dimensions not in [*self.__images]: # if it's requested for a size we havent made yet
-            img_path = image_utils.resize_image(cv2.imread(list(self.__images.values())[0]), dimensions, filename, save_path=save_path, filetype="PNG") # downsize the original image and return it instead
-        # if none of these trip, then we already have the image in that size stored in self.__images[dimensions]
 
-        if img_path: # if the fetch didnt fail
-            self.__images[dimensions] = img_path # store it so we can use it again
-            return self.__images[dimensions]
+        return (await self.image_result_async([tuple(dimensions) if dimensions else None], save_path=save_path)).path # None if the fetch failed
+
+    async def images_async(self, sizes, save_path="images"): # {dimensions: path}, or None if there's no image or fetching it failed
+        return (await self.image_result_async(sizes, save_path=save_path)).paths
+
+    async def image_result_async(self, sizes, save_path="images"):
+        """
+            Makes the article's image in every one of sizes, a list of (width, height) tuples (None is the full-sized image),
+            from a single download and decode. Returns an ImageResult, with {dimensions: path} as its paths if it worked.
+
+            Sizes made before are reused. New ones are shrunk from the full-sized copy on disk, or, if the client has an
+            image store, fetched from the store again; then the full-sized image never has to be decoded or saved, and
+            small thumbnails of big JPEGs are decoded at a fraction of their size.
+        """
+        if self.image_url is None:
+            return ImageResult(IMAGE_MISSING, None)
+        sizes = [tuple(dimensions) if dimensions else None for dimensions in sizes]
+        if self.__images:
+            for dimensions in set(sizes) | {None}: # image store eviction or a cleanup may have deleted sizes made before
+                if dimensions in self.__images and not os.path.exists(self.__images[dimensions]):
+                    del self.__images[dimensions]
+        missing_sizes = [dimensions for dimensions in sizes if not self.__images or dimensions not in self.__images]
+        pipeline = self.__parent_client.image_pipeline
+        filename = self.uid or hashlib.sha3_224(self.url.encode(TEXT_ENCODING_FORMAT)).hexdigest() # articles without a title dont have a uid
+
+        if missing_sizes and self.__images and None in self.__images: # sizes we havent made yet get shrunk from the full-sized image
+            img_paths = await pipeline.resize_file_all(self.__images[None], missing_sizes, filename, save_path=save_path, filetype="jpeg")
+            if img_paths is None: # the full-sized copy was deleted or damaged since we made it, so forget it and download it again next time
+                return ImageResult(IMAGE_DECODE_ERROR, self.image_url, reason="[ERROR] Couldn't read {}.".format(self.__images.pop(None)))
+        elif missing_sizes:
+            if pipeline.image_store is None: # the full-sized image too, so later sizes dont need another download
+                missing_sizes = [None] + [dimensions for dimensions in missing_sizes if dimensions is not None]
+            result = await pipeline.fetch_image(self.image_url, filename, missing_sizes, save_path=save_path)
+            if not result.ok:
+                return result
+            img_paths = result.paths
         else:
-            #return None #DEBUGGING
-            return "img_path was none"
+            img_paths = {}
+
+        if self.__images is None:
+            self.__images = OrderedDict()
+        if None in img_paths:
+            self.__images[None] = img_paths[None]
+            self.__images.move_to_end(None, last=False) # always stores the full-sized image first
+        self.__images.update(img_paths) # img_paths may be shared with other articles, so its left alone
+        return ImageResult(IMAGE_OK, self.image_url, paths={dimensions: self.__images[dimensions] for dimensions in sizes})
 
     def image(self, dimensions=None):
         return self.__parent_client.event_loop.run_until_complete(self.image_async(dimensions=dimensions))
@@ -137,15 +240,106 @@ class NewsArticle(object):
 
         return json.dumps(ret)
 
-def parse_newsapi_time(newsapi_time_string): # WORKS
-    actual_datetime = newsapi_time_string.split('+')[0].split('.')[0] # filters out time offset and useless decimal seconds
-    actual_datetime = actual_datetime.replace('Z', '') # sometimes there's a Z on the end of the time?
-    return datetime.strptime(actual_datetime, NEWSAPI_PARSED_TIME_FORMAT)
+    def to_dict(self): # the article in the shape NewsAPI sends it, plus any proper nouns already extracted; NewsArticle(client, article.to_dict()) rebuilds it
+        if self.__time_published is None or isinstance(self.__time_published, str): # never parsed, so theres nothing to format
+            published_at = self.__time_published
+        else:
+            published_at = datetime.strftime(self.__time_published, NEWSAPI_PARSED_TIME_FORMAT) + "Z"
+
+        ret = {"source": {"id": None, "name": self.source}, "author": self.authors, "title": self.title, "description": self.description,
+               "url": self.url, "urlToImage": self.image_url, "publishedAt": published_at, "content": self.content}
+        if self.__proper_nouns_in_title is not None or self.__proper_nouns_in_description is not None:
+            ret["properNouns"] = [self.__proper_nouns_in_title, self.__proper_nouns_in_description] # None for whichever hasnt been extracted yet
+
+        return ret
+
+def initialize_proper_nouns_of_articles(articles): # tags every title and description in one batch, which is much faster than one article at a time
+    return set_proper_nouns_of_articles(articles, extract_proper_nouns_batch(proper_noun_texts_of_articles(articles)))
+
+
+def proper_noun_texts_of_articles(articles): # [title, description, title, description, ...]
+    texts = []
+    for article in articles:
+        texts.append(article.title)
+        texts.append(article.description)
+    return texts
+
+
+def set_proper_nouns_of_articles(articles, proper_nouns): # proper_nouns lines up with proper_noun_texts_of_articles(articles)
+    for i, article in enumerate(articles):
+        article.set_proper_nouns(proper_nouns[2 * i], proper_nouns[2 * i + 1])
+        article.all_proper_nouns # evaluate it now too, like force_initialize_proper_nouns does
+
+    return articles
+
+
+_NEWSAPI_TIME_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.\d+)?(?:Z|([+-])(\d{2}):?(\d{2}))?$")
+
+
+def parse_newsapi_time(newsapi_time_string): # returns a naive datetime in UTC, truncated to the second
+    if not newsapi_time_string:
+        return None
+    if len(newsapi_time_string) == 20 and newsapi_time_string[19] == 'Z': # "2019-06-01T10:00:00Z", which is nearly every time NewsAPI sends
+        return datetime.fromisoformat(newsapi_time_string[:19])
+
+    match = _NEWSAPI_TIME_PATTERN.match(newsapi_time_string)
+    if match is None:
+        raise ValueError("[ERROR] '{}' is not a time NewsAPI would send.".format(newsapi_time_string))
+    time_published = datetime.fromisoformat(match.group(1)) # fractional seconds are dropped, NewsAPI times are only meaningful to the second
+    if match.group(2): # an offset like +05:30 rather than Z, so shift the time back to UTC
+        offset = timedelta(hours=int(match.group(3)), minutes=int(match.group(4)))
+        time_published = time_published - offset if match.group(2) == '+' else time_published + offset
+
+    return time_published
+
+
+def parse_newsapi_times(newsapi_time_strings): # parses a whole page at once into a datetime64 array, with NaT for missing times
+    newsapi_time_strings = list(newsapi_time_strings)
+    is_utc_second = [bool(time_string) and len(time_string) == 20 and time_string[19] == 'Z' for time_string in newsapi_time_strings]
+    times_published = np.array([time_string[:19] if utc_second else "NaT" for time_string, utc_second in zip(newsapi_time_strings, is_utc_second)],
+                               dtype="datetime64[{}]".format(NEWSAPI_TIME_UNIT)) # numpy parses plain ISO times in C
+    for i, time_string in enumerate(newsapi_time_strings):
+        if time_string and not is_utc_second[i]: # offsets and fractional seconds are rare enough to go through the slow path
+            times_published[i] = parse_newsapi_time(time_string)
+
+    return times_published
 
 
 def format_text(text):
     ret = text.split('\r')[0].replace("\xa0", " ") # filters out long description ads and non-breaking spaces
-    for signature in NEWS_SIGNATURES:
-        ret = ret.replace(signature, "") # removes news signatures that trip proper noun detection
+    ret = _news_signature_pattern.sub("", ret) # removes news signatures that trip proper noun detection, all in one pass
 
     return ret.strip() # remove end spaces and return
+
+
+def add_news_signatures(*signatures): # strips more signatures from every article made from now on, i.e. for outlets missing from const.NEWS_SIGNATURES
+    global _news_signature_pattern
+    _news_signatures.extend(signature for signature in signatures if signature and signature not in _news_signatures)
+    _news_signature_pattern = _compile_news_signatures(_news_signatures)
+
+
+def _compile_news_signatures(signatures):
+    """
+        Compiles the signatures into one regex shaped like a trie of them, i.e. "- C(?:NN|BS)", so matching is a walk
+        down the trie at each position rather than trying every signature in turn. Longer matches win over their prefixes.
+    """
+    trie = {}
+    for signature in signatures:
+        node = trie
+        for character in signature:
+            node = node.setdefault(character, {})
+        node[""] = True # a signature ends here
+
+    return re.compile(_trie_pattern(trie) or "(?!)") # (?!) never matches, for when there are no signatures at all
+
+
+def _trie_pattern(node):
+    branches = [re.escape(character) + _trie_pattern(child) for character, child in sorted(node.items()) if character]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return "(?:" + pattern + ")?" if "" in node else pattern # the signature could also end right here, but greedily try to go further
+
+
+_news_signatures = list(NEWS_SIGNATURES)
+_news_signature_pattern = _compile_news_signatures(_news_signatures)
@@ -0,0 +1,211 @@
+import hashlib
+import numpy as np
+
+from sys import intern
+
+from newsapy.const import GARBAGE_SOURCES, TEXT_ENCODING_FORMAT, NEWSAPI_TIME_UNIT
+from newsapy.newsapi_article import NewsArticle, format_text, parse_newsapi_times
+
+
+
+class NewsArticleBatch(object):
+    """
+        A page (or many pages) of articles stored column by column, so filtering, sorting and deduplicating them are
+        NumPy operations instead of Python loops. NewsArticle objects are only built when an article is asked for.
+
+        Timestamps are a datetime64 array, sources are codes into a list of interned source names, and each text field
+        is one string with start/end offset arrays into it, so reordering a batch never copies any text.
+    """
+    TEXT_FIELDS = ("title", "description", "content", "url", "authors", "image_url")
+
+    def __init__(self, client, times_published, source_names, source_codes, uids, text_columns):
+        self.client = client
+        self.times_published = times_published # datetime64 array; NaT where NewsAPI didn't give a time
+        self.source_names = source_names # list of distinct source names
+        self.source_codes = source_codes # int32 array of indices into source_names
+        self.uids = uids # str array, "" for articles without a uid
+        self.__text_columns = text_columns # field name -> _TextColumn
+
+    @classmethod
+    def from_reply_json(cls, reply_json, client=None): # takes a reply from the everything or top headlines endpoints, or just its "articles" list
+        article_jsons = reply_json["articles"] if isinstance(reply_json, dict) else reply_json
+        source_indices = {}
+        source_codes = np.empty(len(article_jsons), dtype=np.int32)
+        texts = {field: [] for field in cls.TEXT_FIELDS}
+        uids = []
+
+        for i, article_json in enumerate(article_jsons):
+            source = article_json["source"]["name"] or ""
+            source_codes[i] = source_indices.setdefault(intern(source), len(source_indices))
+            url = article_json["url"]
+            texts["url"].append(url)
+            texts["authors"].append(article_json["author"])
+
+            if any(garbage_source in url for garbage_source in GARBAGE_SOURCES): # same as NewsArticle: keep these, but blank
+                title, description, content, image_url = "", "", "", None
+            else:
+                title = format_text(article_json["title"]) if article_json["title"] else ""
+                description = format_text(article_json["description"]) if article_json["description"] else ""
+                content = format_text(article_json["content"]) if article_json["content"] else ""
+                image_url = article_json["urlToImage"]
+            texts["title"].append(title)
+            texts["description"].append(description)
+            texts["content"].append(content)
+            texts["image_url"].append(image_url)
+            uids.append(hashlib.sha3_224((title + source).encode(TEXT_ENCODING_FORMAT)).hexdigest() if title and source else "")
+
+        times_published = parse_newsapi_times(article_json["publishedAt"] for article_json in article_jsons)
+        return cls(client, times_published, list(source_indices), source_codes, np.array(uids, dtype=str),
+                   {field: _TextColumn.from_values(values) for field, values in texts.items()})
+
+    @classmethod
+    def from_articles(cls, articles, client=None):
+        source_indices = {}
+        source_codes = np.array([source_indices.setdefault(intern(article.source or ""), len(source_indices)) for article in articles], dtype=np.int32)
+        times_published = np.array([article.time_published for article in articles], dtype="datetime64[{}]".format(NEWSAPI_TIME_UNIT))
+        uids = np.array([article.uid or "" for article in articles], dtype=str)
+        text_columns = {field: _TextColumn.from_values([getattr(article, field) for article in articles]) for field in cls.TEXT_FIELDS}
+        return cls(client, times_published, list(source_indices), source_codes, uids, text_columns)
+
+    @classmethod
+    def concatenate(cls, batches):
+        batches = list(batches)
+        if not batches:
+            return cls.from_reply_json([])
+
+        source_indices = {}
+        source_codes = []
+        for batch in batches: # re-map each batch's source codes onto one shared list of names
+            remap = np.array([source_indices.setdefault(name, len(source_indices)) for name in batch.source_names], dtype=np.int32)
+            source_codes.append(remap[batch.source_codes] if len(remap) else batch.source_codes)
+
+        return cls(batches[0].client, np.concatenate([batch.times_published for batch in batches]), list(source_indices), np.concatenate(source_codes),
+                   np.concatenate([batch.uids for batch in batches]),
+                   {field: _TextColumn.concatenate([batch.__text_columns[field] for batch in batches]) for field in cls.TEXT_FIELDS})
+
+    @classmethod
+    def load(cls, fp, client=None): # reads a batch written by save; no JSON is parsed and no text is formatted again
+        with np.load(fp, allow_pickle=False) as arrays:
+            def text_column(name):
+                data = arrays[name + "_data"].tobytes().decode(TEXT_ENCODING_FORMAT, "surrogatepass")
+                return _TextColumn(data, arrays[name + "_starts"], arrays[name + "_ends"])
+
+            source_names = text_column("source_names")
+            return cls(client, arrays["times_published"], [source_names[i] for i in range(len(source_names.starts))], arrays["source_codes"],
+                       arrays["uids"].astype(str), {field: text_column(field) for field in cls.TEXT_FIELDS})
+
+    def save(self, fp, compress=False):
+        """
+            Writes the batch's columns to an .npz file: the times, source codes and uids as they are, and each text field
+            as its UTF-8 bytes and offsets. Nothing is encoded per article, which makes it far faster than any JSON export.
+
+            (str or file) fp - A path or a file opened in binary mode.
+
+            (bool) compress - Deflate the columns; smaller, but slower to write and read.
+        """
+        arrays = {"times_published": self.times_published, "source_codes": self.source_codes, "uids": self.uids.astype(np.bytes_)} # uids are hex, so one byte a character instead of four
+        text_columns = dict(self.__text_columns, source_names=_TextColumn.from_values(self.source_names))
+        for name, text_column in text_columns.items():
+            arrays[name + "_data"] = np.frombuffer(text_column.data.encode(TEXT_ENCODING_FORMAT, "surrogatepass"), dtype=np.uint8)
+            arrays[name + "_starts"] = text_column.starts # offsets count characters, so they still line up once the data is decoded
+            arrays[name + "_ends"] = text_column.ends
+
+        (np.savez_compressed if compress else np.savez)(fp, **arrays)
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.article(index)
+        return self.take(np.arange(len(self))[index] if isinstance(index, slice) else index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.article(i)
+
+    def article(self, i): # builds the NewsArticle for row i
+        return NewsArticle(self.client, self.article_json(i))
+
+    def article_json(self, i): # row i in the shape NewsAPI returns it, already formatted
+        article_json = {field: self.__text_columns[field][i] for field in self.TEXT_FIELDS}
+        time_published = self.times_published[i]
+        return {"source": {"id": None, "name": self.source_names[self.source_codes[i]]}, "author": article_json["authors"], "url": article_json["url"],
+                "urlToImage": article_json["image_url"], "title": article_json["title"], "description": article_json["description"],
+                "content": article_json["content"], "publishedAt": None if np.isnat(time_published) else str(time_published) + "Z"}
+
+    def to_articles(self):
+        return list(self)
+
+    def column(self, field): # a list of one text field, i.e. batch.column("url")
+        text_column = self.__text_columns[field]
+        return [text_column[i] for i in range(len(self))]
+
+    def take(self, indices): # a new batch of the rows at these indices, in this order
+        indices = np.asarray(indices, dtype=np.intp)
+        return NewsArticleBatch(self.client, self.times_published[indices], self.source_names, self.source_codes[indices], self.uids[indices],
+                                {field: text_column.take(indices) for field, text_column in self.__text_columns.items()})
+
+    def filter(self, mask): # a new batch of the rows where the boolean mask is True
+        return self.take(np.flatnonzero(mask))
+
+    def sort_by_time(self, descending=False): # articles without a time go last either way
+        order = np.argsort(self.times_published, kind="stable")
+        if descending:
+            order = order[::-1]
+            order = np.concatenate([order[~np.isnat(self.times_published[order])], order[np.isnat(self.times_published[order])]])
+        return self.take(order)
+
+    def published_between(self, start=None, end=None): # [start, end]; either can be left out
+        mask = ~np.isnat(self.times_published)
+        if start is not None:
+            mask &= self.times_published >= np.datetime64(start, NEWSAPI_TIME_UNIT)
+        if end is not None:
+            mask &= self.times_published <= np.datetime64(end, NEWSAPI_TIME_UNIT)
+        return self.filter(mask)
+
+    def from_sources(self, *source_names):
+        codes = [i for i, name in enumerate(self.source_names) if name in source_names]
+        return self.filter(np.isin(self.source_codes, codes))
+
+    def deduplicate(self): # keeps the first of every group of articles sharing a uid; articles without a uid are all kept
+        _, first_indices = np.unique(self.uids, return_index=True)
+        keep = np.zeros(len(self), dtype=bool)
+        keep[first_indices] = True
+        keep |= self.uids == ""
+        return self.filter(keep)
+
+
+class _TextColumn(object):
+    __slots__ = ("data", "starts", "ends")
+
+    def __init__(self, data, starts, ends):
+        self.data = data # every value of the column, concatenated
+        self.starts = starts # start offset of each value in data, or -1 for None
+        self.ends = ends
+
+    @classmethod
+    def from_values(cls, values):
+        lengths = np.fromiter((len(value) if value is not None else 0 for value in values), dtype=np.int64, count=len(values))
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        starts[np.fromiter((value is None for value in values), dtype=bool, count=len(values))] = -1
+        return cls("".join(value for value in values if value), starts, ends)
+
+    @classmethod
+    def concatenate(cls, columns):
+        starts = []
+        ends = []
+        shift = 0
+        for column in columns:
+            starts.append(np.where(column.starts >= 0, column.starts + shift, -1))
+            ends.append(column.ends + shift)
+            shift += len(column.data)
+        return cls("".join(column.data for column in columns), np.concatenate(starts), np.concatenate(ends))
+
+    def __getitem__(self, i):
+        start = self.starts[i]
+        return None if start < 0 else self.data[start:self.ends[i]]
+
+    def take(self, indices):
+        return _TextColumn(self.data, self.starts[indices], self.ends[indices])
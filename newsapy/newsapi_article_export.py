@@ -0,0 +1,84 @@
+import gzip
+import json
+
+from contextlib import contextmanager
+from newsapy import const
+from newsapy.newsapi_article import NewsArticle
+from newsapy.newsapi_article_batch import NewsArticleBatch
+
+try: # a much faster encoder and decoder, used when its installed
+    import orjson
+except ImportError:
+    orjson = None
+
+
+
+def write_ndjson(articles, fp):
+    """
+        Writes articles as newline-delimited JSON, one NewsArticle.to_dict() per line, and returns how many were written.
+
+        (iterable) articles - NewsArticles, or a NewsArticleBatch, whose rows are written without building any NewsArticles.
+
+        (str or file) fp - A path, gzipped if it ends in const.COMPRESSED_FILE_EXTENSION, or a file opened in binary mode.
+    """
+    if isinstance(articles, NewsArticleBatch):
+        records = (articles.article_json(i) for i in range(len(articles)))
+    else:
+        records = (article.to_dict() for article in articles)
+
+    written = 0
+    lines = []
+    with _opened(fp, "wb") as f:
+        for record in records:
+            lines.append(_dumps(record))
+            if len(lines) == const.EXPORT_CHUNK_SIZE: # one write per chunk, rather than one per article or one giant string
+                f.write(b"\n".join(lines) + b"\n")
+                written += len(lines)
+                lines.clear()
+        if lines:
+            f.write(b"\n".join(lines) + b"\n")
+            written += len(lines)
+
+    return written
+
+
+def read_ndjson(fp, client=None, keep_content=True):
+    """
+        Yields the NewsArticles written by write_ndjson, one line at a time, so files bigger than memory can be streamed.
+        Proper nouns that were extracted before the articles were written are restored instead of being extracted again.
+    """
+    with _opened(fp, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = _loads(line)
+            article = NewsArticle(client, record, keep_content=keep_content)
+            if "properNouns" in record:
+                article.set_proper_nouns(*record["properNouns"])
+            yield article
+
+
+def read_ndjson_batch(fp, client=None): # reads a whole file written by write_ndjson into one NewsArticleBatch
+    with _opened(fp, "rb") as f:
+        return NewsArticleBatch.from_reply_json([_loads(line) for line in f if line.strip()], client)
+
+
+@contextmanager
+def _opened(fp, mode):
+    if not isinstance(fp, str): # already a file object, which belongs to the caller
+        yield fp
+        return
+
+    opener = gzip.open if fp.endswith(const.COMPRESSED_FILE_EXTENSION) else open
+    with opener(fp, mode) as f:
+        yield f
+
+
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    def _dumps(record):
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode(const.TEXT_ENCODING_FORMAT)
+
+    _loads = json.loads
@@ -2,10 +2,20 @@ import aiohttp
 import asyncio
 import hashlib
 
+from collections import OrderedDict
 from newsapy import const
-from newsapy.newsapi_auth import NewsApiAuth
-from newsapy.newsapi_article import NewsArticle
+from newsapy.image_store import ImageStore
+from newsapy.image_utils import ImagePipeline
+from newsapy.newsapi_article import NewsArticle, initialize_proper_nouns_of_articles, proper_noun_texts_of_articles, set_proper_nouns_of_articles
+from newsapy.newsapi_article_batch import NewsArticleBatch
+from newsapy.newsapi_disk_cache import DiskResponseCache
+from newsapy.newsapi_key_pool import KeyPool
+from newsapy.newsapi_request_scheduler import RequestScheduler, request_priority
+from newsapy.newsapi_response_cache import ResponseCache
+from newsapy.newsapi_retry_policy import NewsApiError, RetryPolicy
+from newsapy.near_duplicate_index import NearDuplicateIndex
 from newsapy.nltk_handler import initialize_nltk_data
+from newsapy.proper_noun_extraction import extract_proper_nouns_batch, make_proper_noun_process_pool, proper_noun_cache
 from os.path import isdir
 from os import mkdir
 from sys import version_info
@@ -13,33 +23,31 @@ from sys import version_info
 
 
 class NewsApiClient(object):
-    def __init__(self, api_keys_file_path):
+    def __init__(self, api_keys_file_path, key_cooldown=const.KEY_COOLDOWN_SECONDS, retry_policy=None,
+                 max_requests_in_flight=const.MAX_REQUESTS_IN_FLIGHT, requests_per_second_per_key=None, response_cache=None, disk_cache=None, proper_noun_executor=None,
+                 near_duplicate_index=None, lazy_articles=False, image_store=None):
         with open(api_keys_file_path, "r") as f: # this file stores newsapy account data in a [firstname/username/password/api key] format
             self.api_keys = [line.split('/')[3].strip('\n') for line in f.readlines()] # extract just the api keys, then store them
-        self.auth = NewsApiAuth(api_key=self.api_keys[0])
-        self.current_api_key_index = 0
-        self.__consecutive_key_failures = 0
+        self.key_pool = KeyPool(self.api_keys, cooldown=key_cooldown, requests_per_second_per_key=requests_per_second_per_key) # hands out keys per request, each within its own rate limit
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy()
+        self.scheduler = RequestScheduler(max_in_flight=max_requests_in_flight) # the rate limit lives on each key in key_pool, since every key has its own quota
+        self.response_cache = ResponseCache() if response_cache is True else response_cache # pass a ResponseCache to tune its size and TTLs
+        self.disk_cache = DiskResponseCache() if disk_cache is True else disk_cache # checked after response_cache, before the network
+        self.lazy_articles = lazy_articles # articles format their text on first use, for pipelines that filter most of them out by url, source or time
+        self.near_duplicate_index = NearDuplicateIndex() if near_duplicate_index is True else near_duplicate_index # when set, articles of stories already seen are dropped from pages
 
         if not isdir(const.IMAGE_DIRECTORY):
             mkdir(const.IMAGE_DIRECTORY)
         self.event_loop = asyncio.get_event_loop()
         self.http_session = aiohttp.ClientSession()
+        self.image_store = ImageStore() if image_store is True else image_store # shares downloads between articles with the same image, and across runs
+        self.image_pipeline = ImagePipeline(self.http_session, image_store=self.image_store) # article images are downloaded, resized and saved through this
         self.hasher = hashlib.sha3_224()
 
         initialize_nltk_data() # ensures that all the data needed for proper noun extraction is downloaded
 
-    def __switch_api_keys(self, forever=False):
-        if self.__consecutive_key_failures == len(self.api_keys) + 1: # plus one means "see if the first key has cooled down before exploding"
-            raise Exception("[ERROR] All {} provided NewsAPI keys are on ratelimit. Impressive!".format(len(self.api_keys)))
-
-        if self.current_api_key_index == len(self.api_keys) - 1: # if were at the end of the list of api keys
-            self.current_api_key_index = 0 # cycle back to the start
-        else: # otherwise,
-            self.current_api_key_index += 1 # go to the next api key
-
-        self.auth = NewsApiAuth(api_key=self.api_keys[self.current_api_key_index]) # refreshing key means we have to change the auth headers
-        if not forever: # unless we were specifically told to infinitely loop over ratelimited api keys until one cools down,
-            self.__consecutive_key_failures += 1 # remember that this key was limited
+        self.__owns_proper_noun_executor = proper_noun_executor is True # we only shut down executors we made ourselves
+        self.proper_noun_executor = make_proper_noun_process_pool() if proper_noun_executor is True else proper_noun_executor # any concurrent.futures executor works
 
     def get_top_headlines(self, q=None, sources=None, language='en', country=None, category=None,
                                       page_size=20, page=None, force_initialize_proper_nouns=False, query_results_tuple=False):
@@ -159,15 +167,8 @@ class NewsApiClient(object):
                 raise TypeError('page param should be an int')
 
         # Send Request
-        async with (await self.http_session.get(const.TOP_HEADLINES_URL, headers=self.auth(), timeout=30, params=payload)) as request:
-            reply_json = await request.json()
-            if request.status != const.HTTP_OK: # if the request failed, this usually means were ratlimited #TODO: Make this catch timeout errors *only*, so it doesnt trigger when the internet goes down
-                self.__switch_api_keys()
-                return await self.get_top_headlines_async(q=q, sources=sources, language=language, country=country, category=category, page_size=page_size, page=page, force_initialize_proper_nouns=force_initialize_proper_nouns, query_results_tuple=query_results_tuple)
-
-        self.__consecutive_key_failures = 0 # once the request works, we know we have at least one working api key
-        articles = [NewsArticle(self, article, force_initialize_proper_nouns=force_initialize_proper_nouns) for article
-                    in reply_json["articles"]]
+        reply_json = await self.__fetch_json_async(const.TOP_HEADLINES_URL, payload)
+        articles = await self.__articles_from_reply_async(reply_json, force_initialize_proper_nouns=force_initialize_proper_nouns)
         if query_results_tuple:  # usually to keep track of queries when sending multiple requests at once
             if q and query_results_tuple == "keyword": # if we were told to group articles with keywords
                 return q, articles
@@ -217,6 +218,107 @@ class NewsApiClient(object):
 		(int) page - Use this to page through the results if the total results found is greater than the page size.
         """
 
+        payload = self.__everything_payload(q=q, sources=sources, domains=domains, exclude_domains=exclude_domains, from_param=from_param, to=to,
+                                            language=language, sort_by=sort_by, page=page, page_size=page_size)
+
+        # Send Request
+        reply_json = await self.__fetch_json_async(const.EVERYTHING_URL, payload)
+        articles = await self.__articles_from_reply_async(reply_json, force_initialize_proper_nouns=force_initialize_proper_nouns)
+        if query_results_tuple: #  usually to keep track of queries or sources when sending multiple requests at once
+            if q and query_results_tuple == "keyword": # if we were told to group articles with keywords
+                return q, articles
+            if query_results_tuple == "source": # if we were told to group articles with sources
+                return sources[0], articles # assume this is only called when theres only one source
+        else:
+            return articles
+
+    def get_everything_all(self, q=None, sources=None, domains=None, exclude_domains=None,
+                           from_param=None, to=None, language='en', sort_by=None, page_size=100,
+                           max_pages=None, max_results=None, max_concurrent_pages=const.MAX_CONCURRENT_PAGES, force_initialize_proper_nouns=False, as_batches=False):
+        return self.event_loop.run_until_complete(self.get_everything_all_async(q=q, sources=sources, domains=domains, exclude_domains=exclude_domains, from_param=from_param, to=to, language=language, sort_by=sort_by,
+                                                                                page_size=page_size, max_pages=max_pages, max_results=max_results, max_concurrent_pages=max_concurrent_pages, force_initialize_proper_nouns=force_initialize_proper_nouns, as_batches=as_batches))
+
+    async def get_everything_all_async(self, q=None, sources=None, domains=None, exclude_domains=None,
+                                       from_param=None, to=None, language='en', sort_by=None, page_size=100,
+                                       max_pages=None, max_results=None, max_concurrent_pages=const.MAX_CONCURRENT_PAGES, force_initialize_proper_nouns=False, as_batches=False):
+        ret = []
+        async for articles in self.iter_everything_async(q=q, sources=sources, domains=domains, exclude_domains=exclude_domains, from_param=from_param, to=to, language=language, sort_by=sort_by,
+                                                         page_size=page_size, max_pages=max_pages, max_results=max_results, max_concurrent_pages=max_concurrent_pages,
+                                                         force_initialize_proper_nouns=force_initialize_proper_nouns, as_batches=as_batches):
+            if as_batches:
+                ret.append(articles)
+            else:
+                ret.extend(articles)
+        return NewsArticleBatch.concatenate(ret) if as_batches else ret
+
+    async def iter_everything_async(self, q=None, sources=None, domains=None, exclude_domains=None,
+                                    from_param=None, to=None, language='en', sort_by=None, page_size=100,
+                                    max_pages=None, max_results=None, max_concurrent_pages=const.MAX_CONCURRENT_PAGES, force_initialize_proper_nouns=False, as_batches=False):
+        """
+            Pages through every result of an /everything query, yielding one list of NewsArticles per page.
+
+            The first page is fetched on its own to learn 'totalResults'; the remaining pages are then requested
+            concurrently (at most max_concurrent_pages at a time) and yielded in the order they arrive, not page order.
+
+            Takes the same parameters as get_everything_async, plus:
+                (int) max_pages - Stop after this many pages, regardless of 'totalResults'.
+
+                (int) max_results - Stop after this many results; the page they end on is cut short. Useful on plans that
+                                    refuse to page past a fixed number of results.
+
+                (int) max_concurrent_pages - The number of page requests allowed in flight at once.
+
+                (bool) as_batches - Yield each page as a columnar NewsArticleBatch instead of a list of NewsArticles.
+                                    force_initialize_proper_nouns is ignored, since batches build their articles on demand.
+        """
+        if type(max_concurrent_pages) != int or max_concurrent_pages < 1:
+            raise ValueError('max_concurrent_pages param should be an int greater than 0')
+
+        payload = self.__everything_payload(q=q, sources=sources, domains=domains, exclude_domains=exclude_domains, from_param=from_param, to=to,
+                                            language=language, sort_by=sort_by, page=1, page_size=page_size)
+        if not page_size: # a page size of 0 or None would never get us past the first page
+            raise ValueError('page_size param should be an int between 1 and 100')
+
+        def trimmed(reply_json, page_number): # drops the results of the last page that go past max_results
+            results_left = None if max_results is None else max_results - (page_number - 1) * page_size
+            if results_left is None or len(reply_json.get("articles", [])) <= results_left:
+                return reply_json
+            return dict(reply_json, articles=reply_json["articles"][:max(0, results_left)]) # a copy, since cached replies are shared
+
+        first_reply_json = await self.__fetch_json_async(const.EVERYTHING_URL, payload)
+        yield await self.__page_from_reply_async(trimmed(first_reply_json, 1), force_initialize_proper_nouns, as_batches)
+
+        total_results = first_reply_json.get("totalResults", 0)
+        if max_results is not None:
+            total_results = min(total_results, max_results)
+        total_pages = -(-total_results // page_size) # ceiling division
+        if max_pages is not None:
+            total_pages = min(total_pages, max_pages)
+        if total_pages < 2: # everything fit on the first page
+            return
+
+        page_limiter = asyncio.Semaphore(max_concurrent_pages)
+
+        async def fetch_page(page_number):
+            async with page_limiter:
+                page_payload = dict(payload)
+                page_payload['page'] = page_number
+                return trimmed(await self.__fetch_json_async(const.EVERYTHING_URL, page_payload), page_number)
+
+        priority_token = request_priority.set(const.PRIORITY_LOW) if request_priority.get() is None else None # deep pages are backfill, so let other requests go first
+        page_futures = [asyncio.ensure_future(fetch_page(page_number)) for page_number in range(2, total_pages + 1)]
+        if priority_token:
+            request_priority.reset(priority_token)
+        try:
+            for page_future in asyncio.as_completed(page_futures):
+                reply_json = await page_future
+                yield await self.__page_from_reply_async(reply_json, force_initialize_proper_nouns, as_batches)
+        finally:
+            for page_future in page_futures: # if the caller stopped iterating early, dont leave pages downloading in the background
+                page_future.cancel()
+
+    def __everything_payload(self, q=None, sources=None, domains=None, exclude_domains=None,
+                             from_param=None, to=None, language='en', sort_by=None, page=None, page_size=20):
         # Define Payload
         payload = {}
 
@@ -326,24 +428,7 @@ class NewsApiClient(object):
             else:
                 raise TypeError('page param should be an int')
 
-        # Send Request
-
-        async with self.http_session.get(const.EVERYTHING_URL, headers=self.auth(), timeout=30, params=payload) as request:
-            reply_json = await request.json()
-            # Check Status of Request
-            if request.status != const.HTTP_OK:
-                self.__switch_api_keys()
-                return await self.get_everything_async(q=q, sources=sources, language=language, domains=domains, exclude_domains=exclude_domains, from_param=from_param, to=to, sort_by=sort_by, page_size=page_size, page=page, force_initialize_proper_nouns=force_initialize_proper_nouns, query_results_tuple=query_results_tuple)
-
-        self.__consecutive_key_failures = 0 # once a request works, we know we have at least one working key
-        articles = [NewsArticle(self, article, force_initialize_proper_nouns=force_initialize_proper_nouns) for article in reply_json["articles"]]
-        if query_results_tuple: #  usually to keep track of queries or sources when sending multiple requests at once
-            if q and query_results_tuple == "keyword": # if we were told to group articles with keywords
-                return q, articles
-            if query_results_tuple == "source": # if we were told to group articles with sources
-                return sources[0], articles # assume this is only called when theres only one source
-        else:
-            return articles
+        return payload
 
     def get_sources(self, category=None, language='en', country=None):
         return self.event_loop.run_until_complete(self.get_sources_async(category=category, language=language, country=country))
@@ -403,24 +488,94 @@ class NewsApiClient(object):
                 raise TypeError('category param should be of type str')
 
         # Send Request
-        async with self.http_session.get(const.SOURCES_URL, headers=self.auth(), timeout=30, params=payload) as request:
-            # Check Status of Request
-            reply_json = await request.json()
-            if request.status != const.HTTP_OK:
-                self.__switch_api_keys()
-                return await self.get_sources_async(language=language, country=country, category=category)
+        return await self.__fetch_json_async(const.SOURCES_URL, payload)
+
+    async def __fetch_json_async(self, url, payload):
+        if self.response_cache is None:
+            return await self.__fetch_json_from_disk_or_network_async(url, payload)
+        return await self.response_cache.get_or_fetch(url, payload, lambda: self.__fetch_json_from_disk_or_network_async(url, payload))
+
+    async def __fetch_json_from_disk_or_network_async(self, url, payload):
+        if self.disk_cache is None:
+            return await self.__send_request_async(url, payload)
+        return await self.disk_cache.get_or_fetch(url, payload, lambda: self.__send_request_async(url, payload))
+
+    async def __send_request_async(self, url, payload):
+        priority = request_priority.get()
+        if priority is None:
+            priority = const.ENDPOINT_PRIORITIES.get(url, const.PRIORITY_NORMAL)
+
+        attempt = 0
+        while True:
+            status = None
+            headers = None
+            reply_json = None
+            error = None
+            async with self.scheduler.slot(priority): # caps requests in flight, serving higher priorities first
+                key = await self.key_pool.acquire(priority) # waits for a key to cool down or get a token back, in priority order
+                try:
+                    async with self.http_session.get(url, headers=key.auth(), timeout=30, params=payload) as request:
+                        status = request.status
+                        headers = request.headers
+                        reply_json = await request.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+                finally:
+                    self.key_pool.release(key, status=status, headers=headers) # the pool puts ratelimited keys on cooldown and drops rejected ones
+
+            if status == const.HTTP_OK and error is None:
+                return reply_json
+
+            outcome = self.retry_policy.classify(status=status, exception=error)
+            if not self.retry_policy.should_retry(attempt, outcome):
+                reply_json = reply_json if isinstance(reply_json, dict) else {}
+                raise NewsApiError("[ERROR] NewsAPI request to {} failed after {} attempt(s) (status {}): {}".format(url, attempt + 1, status, reply_json.get("message", error)),
+                                   status=status, code=reply_json.get("code"), reply_json=reply_json)
+            await self.retry_policy.wait(attempt, outcome)
+            attempt += 1
+
+    async def __page_from_reply_async(self, reply_json, force_initialize_proper_nouns, as_batch):
+        if as_batch:
+            return NewsArticleBatch.from_reply_json(reply_json, client=self)
+        return await self.__articles_from_reply_async(reply_json, force_initialize_proper_nouns=force_initialize_proper_nouns)
+
+    async def __articles_from_reply_async(self, reply_json, force_initialize_proper_nouns=False):
+        articles = [NewsArticle(self, article, lazy=self.lazy_articles) for article in reply_json["articles"]]
+        if self.near_duplicate_index is not None: # before tagging, so republished stories are never tagged or downloaded again
+            articles = list(self.near_duplicate_index.unique(articles))
+        if force_initialize_proper_nouns: # tag the whole page at once rather than article by article
+            await self.initialize_proper_nouns_async(articles)
+        return articles
+
+    async def initialize_proper_nouns_async(self, articles):
+        """
+            Computes the proper nouns of every article in the list, in batches.
+
+            If the client was given a proper_noun_executor, the batches are tagged in parallel on it, so the event loop
+            (and every other request in flight) keeps running in the meantime. Otherwise they're tagged right here.
+        """
+        if self.proper_noun_executor is None:
+            return initialize_proper_nouns_of_articles(articles)
 
-        self.__consecutive_key_failures = 0 # one the request works, we know we have at least one working api key
-        return reply_json
+        texts = proper_noun_texts_of_articles(articles)
+        proper_nouns = [proper_noun_cache.get(text) for text in texts] # workers have caches of their own, but only this one sees every page
+        missing_texts = list(OrderedDict.fromkeys(text for text, nouns in zip(texts, proper_nouns) if nouns is None))
+        chunks = [missing_texts[i:i + const.PROPER_NOUN_BATCH_SIZE] for i in range(0, len(missing_texts), const.PROPER_NOUN_BATCH_SIZE)] # one chunk per job, so several workers share a page
+        chunk_results = await asyncio.gather(*[self.event_loop.run_in_executor(self.proper_noun_executor, extract_proper_nouns_batch, chunk, False) for chunk in chunks])
+
+        extracted = dict(zip(missing_texts, [nouns for chunk_result in chunk_results for nouns in chunk_result]))
+        for text, nouns in extracted.items():
+            proper_noun_cache.put(text, nouns)
+        return set_proper_nouns_of_articles(articles, [nouns if nouns is not None else list(extracted[text]) for text, nouns in zip(texts, proper_nouns)])
 
     def simultaneous_source_search_from_keyword(self, news_sources, keyword, search_type="everything", **kwargs): # returns a dictionary of the form (source, results_from_source)
         ret = {}
         if search_type == "top_headlines":
             source_article_list_pairs = self.event_loop.run_until_complete(
-                self.run_requests_async([(news_source, self.get_top_headlines_async(q=keyword, sources=[news_source], query_results_tuple="source", **kwargs)) for news_source in news_sources]))
+                self.run_requests_async([self.get_top_headlines_async(q=keyword, sources=[news_source], query_results_tuple="source", **kwargs) for news_source in news_sources]))
         else:
             source_article_list_pairs = self.event_loop.run_until_complete(
-                self.run_requests_async([(news_source, self.get_everything_async(q=keyword, sources=[news_source], query_results_tuple="source", **kwargs))for news_source in news_sources]))
+                self.run_requests_async([self.get_everything_async(q=keyword, sources=[news_source], query_results_tuple="source", **kwargs) for news_source in news_sources]))
         for source, article_list in source_article_list_pairs:
             ret[source] = article_list
 
@@ -440,12 +595,50 @@ class NewsApiClient(object):
 
         return ret
 
+    async def stream_source_search_from_keyword_async(self, news_sources, keyword, search_type="everything", **kwargs): # yields (source, article) pairs as soon as each source replies
+        if search_type == "top_headlines":
+            requests_list = [self.get_top_headlines_async(q=keyword, sources=[news_source], query_results_tuple="source", **kwargs) for news_source in news_sources]
+        else:
+            requests_list = [self.get_everything_async(q=keyword, sources=[news_source], query_results_tuple="source", **kwargs) for news_source in news_sources]
+
+        async for source, article_list in self.stream_requests_async(requests_list):
+            for article in article_list:
+                yield source, article
+
+    async def stream_keyword_search_from_sources_async(self, keywords, news_sources, search_type="everything", **kwargs): # yields (keyword, article) pairs as soon as each keyword search replies
+        if search_type == "top_headlines":
+            requests_list = [self.get_top_headlines_async(q=keyword, sources=news_sources, query_results_tuple="keyword", **kwargs) for keyword in keywords]
+        else:
+            requests_list = [self.get_everything_async(q=keyword, sources=news_sources, query_results_tuple="keyword", **kwargs) for keyword in keywords]
+
+        async for keyword, article_list in self.stream_requests_async(requests_list):
+            for article in article_list:
+                yield keyword, article
+
+    async def stream_requests_async(self, requests_list, priority=None): # like run_requests_async, but yields each result as soon as it finishes instead of waiting for all of them
+        request_futures = self.__schedule_requests(requests_list, priority=priority)
+        try:
+            for request_future in asyncio.as_completed(request_futures):
+                yield await request_future
+        finally:
+            for request_future in request_futures: # if the caller stopped iterating early, dont leave requests running in the background
+                request_future.cancel()
 
-    async def run_requests_async(self, requests_list):
-        return await asyncio.gather(*requests_list)
+    async def run_requests_async(self, requests_list, priority=None): # priority is one of const.PRIORITY_HIGH/NORMAL/LOW; None keeps each endpoint's default
+        return await asyncio.gather(*self.__schedule_requests(requests_list, priority=priority))
 
-    def run_requests(self, requests_list):
-        return self.event_loop.run_until_complete(self.run_requests_async(requests_list))
+    def run_requests(self, requests_list, priority=None):
+        return self.event_loop.run_until_complete(self.run_requests_async(requests_list, priority=priority))
+
+    def __schedule_requests(self, requests_list, priority=None):
+        if priority is None:
+            return [asyncio.ensure_future(request) for request in requests_list]
+
+        priority_token = request_priority.set(priority) # tasks copy the current context when theyre created, so they all inherit this lane
+        try:
+            return [asyncio.ensure_future(request) for request in requests_list]
+        finally:
+            request_priority.reset(priority_token)
 
     async def get_images_of_articles_async(self, articles_list, dimensions=None, save_path="images"):
         image_futures = [article.image_async(dimensions=dimensions, save_path=save_path) for article in articles_list] # collect the async image fetching tasks of every article in the list
@@ -454,5 +647,22 @@ class NewsApiClient(object):
     def get_images_of_articles(self, articles_list, dimensions=None, save_path="images"):
         return self.event_loop.run_until_complete(self.get_images_of_articles_async(articles_list, dimensions=dimensions, save_path=save_path))
 
+    async def get_image_sizes_of_articles_async(self, articles_list, sizes, save_path="images"): # one {dimensions: path} per article, each image downloaded and decoded once
+        return await self.run_requests_async([article.images_async(sizes, save_path=save_path) for article in articles_list])
+
+    def get_image_sizes_of_articles(self, articles_list, sizes, save_path="images"):
+        return self.event_loop.run_until_complete(self.get_image_sizes_of_articles_async(articles_list, sizes, save_path=save_path))
+
+    async def get_image_results_of_articles_async(self, articles_list, sizes=(None,), save_path="images"): # one ImageResult per article, saying why it failed if it did
+        return await self.run_requests_async([article.image_result_async(sizes, save_path=save_path) for article in articles_list])
+
+    def get_image_results_of_articles(self, articles_list, sizes=(None,), save_path="images"):
+        return self.event_loop.run_until_complete(self.get_image_results_of_articles_async(articles_list, sizes=sizes, save_path=save_path))
+
     def close(self):
-        self.event_loop.run_until_complete(self.http_session.close())
\ No newline at end of file
+        self.event_loop.run_until_complete(self.http_session.close())
+        self.image_pipeline.close()
+        if self.image_store is not None:
+            self.image_store.save()
+        if self.__owns_proper_noun_executor:
+            self.proper_noun_executor.shutdown()
\ No newline at end of file
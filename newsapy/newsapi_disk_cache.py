@@ -0,0 +1,135 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from newsapy import const
+from newsapy.file_utils import write_atomically
+from newsapy.newsapi_response_cache import cache_key
+from newsapy.newsapi_retry_policy import NewsApiError
+
+
+
+class DiskResponseCache(object):
+    def __init__(self, directory=const.DISK_CACHE_DIRECTORY, max_bytes=const.DISK_CACHE_MAX_BYTES, ttls=None,
+                 default_ttl=const.RESPONSE_CACHE_DEFAULT_TTL_SECONDS, replay_only=False):
+        """
+            A directory of gzipped NewsAPI replies that survives restarts, keyed the same way as ResponseCache.
+
+            (str) directory - Where the replies are stored. Created if it doesn't exist.
+
+            (int) max_bytes - Once the cache grows past this, the least recently used replies are deleted.
+
+            (dict) ttls - {endpoint url: seconds} overrides for how long replies stay fresh; see const.RESPONSE_CACHE_TTLS.
+
+            (bool) replay_only - Never touch the network: serve every reply from disk regardless of age, and raise
+                                 NewsApiError for anything that isn't there. Useful for tests and offline benchmarks.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(const.RESPONSE_CACHE_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self.__total_bytes = None # computed on first write, since scanning a big cache directory isn't free
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    async def get_or_fetch(self, url, payload, fetch):
+        key = cache_key(url, payload)
+        loop = asyncio.get_event_loop()
+        reply_json = await loop.run_in_executor(None, self.load, url, key) # keep disk reads off the event loop
+        if reply_json is not None:
+            self.hits += 1
+            return reply_json
+
+        self.misses += 1
+        if self.replay_only:
+            raise NewsApiError("[ERROR] {} is not in the disk cache at '{}', and replay_only is set.".format(key, self.directory))
+
+        reply_json = await fetch()
+        try:
+            await loop.run_in_executor(None, self.save, url, key, reply_json)
+        except OSError: # a full disk or a vanished directory shouldn't fail a request that already succeeded
+            pass
+        return reply_json
+
+    def load(self, url, key):
+        path = self.__path_of(key)
+        try:
+            modified_at = os.path.getmtime(path)
+            if not self.replay_only and modified_at + self.ttls.get(url, self.default_ttl) < time.time():
+                self.__delete(path)
+                return None
+            try:
+                with gzip.open(path, "rt", encoding=const.TEXT_ENCODING_FORMAT) as f:
+                    entry = json.load(f)
+            except (OSError, EOFError, zlib.error, ValueError): # truncated or corrupted, so it would never load; gzip raises all of these
+                self.__delete(path)
+                return None
+            if entry.get("key") != key: # a hash collision, however unlikely
+                return None
+            os.utime(path, (time.time(), modified_at)) # record the use in atime without refreshing the TTL, which runs off mtime
+        except OSError: # missing, or deleted by another worker since
+            return None
+        return entry["reply"]
+
+    def save(self, url, key, reply_json):
+        if self.ttls.get(url, self.default_ttl) <= 0:
+            return
+        path = self.__path_of(key)
+        write_atomically(path, gzip.compress(json.dumps({"key": key, "reply": reply_json}).encode(const.TEXT_ENCODING_FORMAT)))
+
+        if self.__total_bytes is None:
+            self.__total_bytes = sum(size for _, _, size in self.__entries())
+        else:
+            try:
+                self.__total_bytes += os.path.getsize(path)
+            except OSError: # already evicted by another worker
+                pass
+        if self.__total_bytes > self.max_bytes:
+            self.__evict()
+
+    def clear(self):
+        for path, _, _ in self.__entries():
+            self.__delete(path)
+        self.__total_bytes = 0
+
+    def __evict(self):
+        entries = sorted(self.__entries(), key=lambda entry: entry[1]) # least recently used first
+        self.__total_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.__total_bytes <= self.max_bytes:
+                break
+            self.__delete(path)
+            self.__total_bytes -= size
+
+    def __entries(self): # (path, last used, size) of every stored reply
+        for filename in os.listdir(self.directory):
+            if filename.endswith(const.DISK_CACHE_FILE_EXTENSION):
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError: # deleted by another worker while we were looking
+                    continue
+                yield path, max(stat.st_atime, stat.st_mtime), stat.st_size
+
+    def __path_of(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode(const.TEXT_ENCODING_FORMAT)).hexdigest() + const.DISK_CACHE_FILE_EXTENSION)
+
+    @staticmethod
+    def __delete(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "replay_only": self.replay_only}
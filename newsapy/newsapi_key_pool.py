@@ -0,0 +1,184 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from newsapy import const
+from newsapy.newsapi_auth import NewsApiAuth
+from newsapy.newsapi_retry_policy import NewsApiError
+
+
+
+class ApiKeyState(object):
+    def __init__(self, api_key, requests_per_second=None, burst=None):
+        self.api_key = api_key
+        self.auth = NewsApiAuth(api_key=api_key)
+        self.in_flight = 0 # requests currently using this key
+        self.requests_sent = 0
+        self.consecutive_ratelimits = 0
+        self.remaining_quota = None # None until NewsAPI tells us otherwise
+        self.cooldown_until = 0.0 # time.monotonic() timestamp; the key is usable again after this
+        self.revoked = False # set when NewsAPI rejects the key outright, since waiting wont fix that
+        self.requests_per_second = requests_per_second # this key's token bucket refill rate; None means no rate limit
+        self.burst = burst if burst else max(1, int(requests_per_second or 1))
+        self.tokens = float(self.burst)
+        self.__last_refill = time.monotonic()
+
+    def is_available(self, now):
+        return not self.revoked and self.cooldown_until <= now and self.__refill(now) >= 1
+
+    def available_in(self, now): # seconds until the key can be used, cooldown and rate limit both
+        wait = max(0.0, self.cooldown_until - now)
+        if self.requests_per_second is not None:
+            wait = max(wait, (1 - self.__refill(now)) / self.requests_per_second)
+        return wait
+
+    def take_token(self):
+        if self.requests_per_second is not None:
+            self.tokens -= 1
+
+    def __refill(self, now):
+        if self.requests_per_second is None:
+            return float("inf")
+        self.tokens = min(self.burst, self.tokens + (now - self.__last_refill) * self.requests_per_second)
+        self.__last_refill = now
+        return self.tokens
+
+
+class KeyPool(object):
+    def __init__(self, api_keys, cooldown=const.KEY_COOLDOWN_SECONDS, requests_per_second_per_key=None, burst=None):
+        """
+            (float) requests_per_second_per_key - Each key's own token bucket refill rate; None means no rate limit.
+                                                  Keys are only handed out with a token to spare, so keys that are
+                                                  cooling down or revoked never push their share onto the live ones.
+
+            (int) burst - How many tokens each key's bucket holds. Defaults to one second's worth.
+        """
+        if not api_keys:
+            raise ValueError("[ERROR] KeyPool needs at least one NewsAPI key.")
+        if requests_per_second_per_key is not None and requests_per_second_per_key <= 0:
+            raise ValueError("[ERROR] requests_per_second_per_key should be positive, or None for no rate limit.")
+        self.keys = [ApiKeyState(api_key, requests_per_second=requests_per_second_per_key, burst=burst) for api_key in api_keys]
+        self.cooldown = cooldown
+        self.__waiting = [] # heap of (priority, arrival order, future) entries, like RequestScheduler's
+        self.__arrival_order = itertools.count()
+        self.__wakeup_handle = None
+
+    async def acquire(self, priority=const.PRIORITY_NORMAL):
+        """
+            Returns the least-loaded usable key, marking it as in use until it's passed back to release().
+
+            If every key is cooling down or out of tokens, waits for the earliest one to be usable instead of giving up.
+            Waiting requests get keys lowest priority number first, and first-come-first-served within a priority.
+            Only raises once every key has been revoked, since no amount of waiting will help then.
+        """
+        if not self.__waiting:
+            key = self.__take_key()
+            if key is not None: # nobody is queued ahead of us, so skip the queue
+                return key
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.__waiting, (priority, next(self.__arrival_order), future))
+        self.__dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): # we were handed a key right as we got cancelled; give it back
+                self.release(future.result())
+            raise
+
+    def __take_key(self):
+        if all(key.revoked for key in self.keys):
+            raise NewsApiError("[ERROR] All {} provided NewsAPI keys were rejected by NewsAPI.".format(len(self.keys)))
+        now = time.monotonic()
+        available_keys = [key for key in self.keys if key.is_available(now)]
+        if not available_keys:
+            return None
+        key = min(available_keys, key=lambda k: (k.in_flight, k.requests_sent)) # spread requests evenly across keys
+        if key.remaining_quota == 0: # its cooldown is over, so its quota has reset
+            key.remaining_quota = None
+        key.take_token()
+        key.in_flight += 1
+        key.requests_sent += 1
+        return key
+
+    def __dispatch(self):
+        while self.__waiting:
+            future = self.__waiting[0][2]
+            if future.done(): # its request was cancelled while waiting
+                heapq.heappop(self.__waiting)
+                continue
+            try:
+                key = self.__take_key()
+            except NewsApiError as e: # every key is gone, so nobody waiting will ever get one
+                for _, _, waiting_future in self.__waiting:
+                    if not waiting_future.done():
+                        waiting_future.set_exception(e)
+                self.__waiting = []
+                return
+            if key is None:
+                break
+            heapq.heappop(self.__waiting)
+            future.set_result(key)
+
+        if self.__wakeup_handle is not None:
+            self.__wakeup_handle.cancel()
+            self.__wakeup_handle = None
+        if self.__waiting: # keys only come off cooldown or get tokens back with time, which wont call us back by itself
+            now = time.monotonic()
+            wait = min(key.available_in(now) for key in self.keys if not key.revoked)
+            self.__wakeup_handle = asyncio.get_event_loop().call_later(wait, self.__wakeup)
+
+    def __wakeup(self):
+        self.__wakeup_handle = None
+        self.__dispatch()
+
+    def release(self, key, status=None, headers=None):
+        """
+            Hands a key back to the pool, along with the status and headers of the reply it was used for (if any).
+        """
+        key.in_flight -= 1
+        headers = headers or {}
+        now = time.monotonic()
+
+        remaining_quota = parse_int_header(headers, const.RATELIMIT_REMAINING_HEADER)
+        if remaining_quota is not None:
+            key.remaining_quota = remaining_quota
+
+        if status == const.HTTP_OK:
+            key.consecutive_ratelimits = 0
+            if key.remaining_quota == 0: # that was the last request this key is allowed for now
+                key.cooldown_until = now + self.__cooldown_from(headers)
+        elif status == const.HTTP_TOO_MANY_REQUESTS:
+            key.consecutive_ratelimits += 1
+            key.cooldown_until = now + self.__cooldown_from(headers)
+        elif status == const.HTTP_UNAUTHORIZED:
+            key.revoked = True
+        if self.__waiting: # a revoked key can leave nothing to wait for, and a new cooldown moves the next wakeup
+            self.__dispatch()
+
+    def __cooldown_from(self, headers):
+        retry_after = parse_int_header(headers, const.RETRY_AFTER_HEADER) # seconds until the key may be used again
+        if retry_after is not None:
+            return retry_after
+
+        ratelimit_reset = parse_int_header(headers, const.RATELIMIT_RESET_HEADER) # unix timestamp of the next quota reset
+        if ratelimit_reset is not None:
+            return max(0, ratelimit_reset - time.time())
+
+        return self.cooldown
+
+    def stats(self):
+        return {key.api_key: {"in_flight": key.in_flight, "requests_sent": key.requests_sent, "remaining_quota": key.remaining_quota,
+                              "cooling_down_for": max(0.0, key.cooldown_until - time.monotonic()), "revoked": key.revoked,
+                              "tokens": key.tokens if key.requests_per_second is not None else None} for key in self.keys}
+
+
+def parse_int_header(headers, name):
+    value = headers.get(name)
+    if value is None:
+        value = headers.get(name.lower()) # aiohttp headers are case-insensitive, but plain dicts arent
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
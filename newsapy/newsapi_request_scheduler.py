@@ -0,0 +1,77 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+
+from newsapy import const
+
+
+
+request_priority = contextvars.ContextVar("newsapy_request_priority", default=None) # lets callers put whole batches of requests in one lane
+
+
+class RequestScheduler(object):
+    def __init__(self, max_in_flight=const.MAX_REQUESTS_IN_FLIGHT):
+        """
+            Hands out request slots, lowest priority number first, and first-come-first-served within a priority.
+            Rate limits are per key, so they're kept by KeyPool, which hands out keys in the same order.
+
+            (int) max_in_flight - The most requests allowed to be waiting on NewsAPI at once.
+        """
+        if max_in_flight < 1:
+            raise ValueError("[ERROR] max_in_flight should be at least 1, or no request would ever be sent.")
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.__waiting = [] # heap of (priority, arrival order, future) entries
+        self.__arrival_order = itertools.count()
+
+    def slot(self, priority=const.PRIORITY_NORMAL):
+        return _SchedulerSlot(self, priority)
+
+    async def acquire(self, priority=const.PRIORITY_NORMAL):
+        if not self.__waiting and self.__take_slot(): # nobody is queued ahead of us, so skip the queue
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.__waiting, (priority, next(self.__arrival_order), future))
+        self.__dispatch() # in case everyone queued ahead of us was cancelled, and a slot is free
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): # we were handed a slot right as we got cancelled; give it back
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self.__dispatch()
+
+    def __dispatch(self):
+        while self.__waiting:
+            future = self.__waiting[0][2]
+            if future.done(): # its request was cancelled while waiting
+                heapq.heappop(self.__waiting)
+                continue
+            if not self.__take_slot():
+                break
+            heapq.heappop(self.__waiting)
+            future.set_result(None)
+
+    def __take_slot(self):
+        if self.in_flight >= self.max_in_flight:
+            return False
+        self.in_flight += 1
+        return True
+
+
+class _SchedulerSlot(object):
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.scheduler.release()
@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from newsapy import const
+
+
+
+class ResponseCache(object):
+    def __init__(self, max_entries=const.RESPONSE_CACHE_MAX_ENTRIES, ttls=None, default_ttl=const.RESPONSE_CACHE_DEFAULT_TTL_SECONDS):
+        """
+            An in-memory, size-bounded LRU cache of NewsAPI replies, keyed on endpoint and payload (never on the api key used).
+
+            (int) max_entries - The most replies kept at once; the least recently used is dropped first.
+
+            (dict) ttls - {endpoint url: seconds} overrides for how long replies stay fresh. A TTL of 0 disables caching
+                          for that endpoint, though concurrent identical requests are still coalesced into one.
+
+            (int) default_ttl - The TTL of endpoints not in ttls or const.RESPONSE_CACHE_TTLS.
+
+            Cached replies are shared between callers, so they should be treated as read-only.
+        """
+        if max_entries < 1:
+            raise ValueError("[ERROR] max_entries should be at least 1.")
+        self.max_entries = max_entries
+        self.ttls = dict(const.RESPONSE_CACHE_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0 # requests that piggybacked on an identical one already in flight
+        self.__entries = OrderedDict() # key -> (expiry time, reply json), oldest use first
+        self.__in_flight = {} # key -> SharedFetch of the reply json
+
+    async def get_or_fetch(self, url, payload, fetch):
+        """
+            Returns the cached reply for this request if there is a fresh one, otherwise awaits fetch() for it.
+            If an identical request is already in flight, waits for its reply instead of sending another.
+        """
+        key = cache_key(url, payload)
+        reply_json = self.get(key)
+        if reply_json is not None:
+            self.hits += 1
+            return reply_json
+
+        shared_fetch = self.__in_flight.get(key)
+        if shared_fetch is not None and not shared_fetch.abandoned():
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            shared_fetch = SharedFetch(self.__fetch_and_put(key, url, fetch))
+            shared_fetch.add_done_callback(lambda _: self.__in_flight.pop(key, None) if self.__in_flight.get(key) is shared_fetch else None)
+            self.__in_flight[key] = shared_fetch
+        return await shared_fetch.wait()
+
+    async def __fetch_and_put(self, key, url, fetch):
+        reply_json = await fetch()
+        self.put(key, url, reply_json)
+        return reply_json
+
+    def get(self, key):
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        expires_at, reply_json = entry
+        if expires_at < time.monotonic():
+            del self.__entries[key]
+            return None
+        self.__entries.move_to_end(key) # mark it as recently used
+        return reply_json
+
+    def put(self, key, url, reply_json):
+        ttl = self.ttls.get(url, self.default_ttl)
+        if ttl <= 0:
+            return
+        self.__entries[key] = (time.monotonic() + ttl, reply_json)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False) # evict the least recently used reply
+
+    def clear(self):
+        self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {"entries": len(self.__entries), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0}
+
+
+def cache_key(url, payload): # payload values are normalized to strings, so pageSize=20 and pageSize="20" share an entry
+    return url + "?" + "&".join("{}={}".format(name, payload[name]) for name in sorted(payload))
+
+
+def _retrieve_exception(future):
+    if not future.cancelled():
+        future.exception()
+
+
+class SharedFetch(object):
+    def __init__(self, coroutine):
+        """
+            Runs one fetch as its own task for every caller that wants its result, so the caller who happened to start it
+            getting cancelled doesn't cancel it for everyone else. It's only cancelled once every caller has given up on it.
+        """
+        self.__task = asyncio.ensure_future(coroutine)
+        self.__task.add_done_callback(_retrieve_exception) # if every waiter gave up, dont warn about an unretrieved exception
+        self.__waiters = 0
+
+    async def wait(self):
+        self.__waiters += 1
+        try:
+            return await asyncio.shield(self.__task)
+        except asyncio.CancelledError:
+            if self.__waiters == 1 and not self.__task.done(): # the last one waiting, so nobody wants the result any more
+                self.__task.cancel()
+            raise
+        finally:
+            self.__waiters -= 1
+
+    def abandoned(self): # cancelled, so later callers should start a fetch of their own
+        return self.__task.cancelled()
+
+    def add_done_callback(self, callback):
+        self.__task.add_done_callback(callback)
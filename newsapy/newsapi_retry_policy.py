@@ -0,0 +1,53 @@
+import aiohttp
+import asyncio
+import random
+
+from newsapy import const
+
+
+
+RETRY_WITH_ANOTHER_KEY = "retry_with_another_key" # ratelimited or rejected key; the key pool paces these, so no backoff
+RETRY_AFTER_BACKOFF = "retry_after_backoff" # server errors, timeouts and dropped connections usually clear up on their own
+GIVE_UP = "give_up" # any other 4xx means the request itself is bad, and resending it wont change that
+
+
+class NewsApiError(Exception):
+    def __init__(self, message, status=None, code=None, reply_json=None):
+        super(NewsApiError, self).__init__(message)
+        self.status = status
+        self.code = code # NewsAPI's own error code, i.e. 'rateLimited' or 'parameterInvalid'
+        self.reply_json = reply_json
+
+
+class RetryPolicy(object):
+    def __init__(self, max_attempts=const.RETRY_MAX_ATTEMPTS, base_delay=const.RETRY_BASE_DELAY_SECONDS,
+                 max_delay=const.RETRY_MAX_DELAY_SECONDS, jitter=True):
+        if max_attempts < 1:
+            raise ValueError("[ERROR] max_attempts should be at least 1, or no request would ever be sent.")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def classify(self, status=None, exception=None):
+        if exception is not None and not isinstance(exception, aiohttp.ClientResponseError): # timeouts and connection errors
+            return RETRY_AFTER_BACKOFF
+        if status == const.HTTP_TOO_MANY_REQUESTS or status == const.HTTP_UNAUTHORIZED:
+            return RETRY_WITH_ANOTHER_KEY
+        if status is None or status >= 500 or status == const.HTTP_OK: # a 200 only gets here if its body was unreadable
+            return RETRY_AFTER_BACKOFF
+        return GIVE_UP
+
+    def should_retry(self, attempt, outcome): # attempt counts from 0
+        return outcome != GIVE_UP and attempt + 1 < self.max_attempts
+
+    def delay(self, attempt, outcome):
+        if outcome == RETRY_WITH_ANOTHER_KEY:
+            return 0
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        if self.jitter: # "full jitter", so clients that failed together dont all retry together
+            delay = random.uniform(0, delay)
+        return delay
+
+    async def wait(self, attempt, outcome):
+        await asyncio.sleep(self.delay(attempt, outcome))
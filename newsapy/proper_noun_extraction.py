@@ -1,11 +1,33 @@
-import nltk
+import hashlib
+import json
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from nltk.tag.perceptron import PerceptronTagger
+
+from newsapy import const
 from newsapy.const import FAKE_PROPER_NOUNS, JOINERS, PUNCTUATION_REPLACEMENT, NODE_DISTINGUISHERS, PUNCTUATION, SENTENCE_INTERRUPTORS, SINGLE_QUOTES, UPPERCASE_ASCII_VALUES_UPPER_BOUND, UPPERCASE_WORD_GARBAGE_THRESHHOLD, PROBLEM_WORDS, PROBLEM_PHRASES, ELLIPSES, WORD_SEPERATORS
 
 
 
+_WORD_SEPERATOR_TABLE = str.maketrans({seperator: ' ' for seperator in WORD_SEPERATORS if len(seperator) == 1})
+_LONG_WORD_SEPERATORS = tuple(seperator for seperator in WORD_SEPERATORS if len(seperator) != 1)
+_SENTENCE_INTERRUPTORS = tuple(SENTENCE_INTERRUPTORS) # the order these get stripped in matters, so these stay sequences
+_ELLIPSES = tuple(ELLIPSES)
+_PUNCTUATION = tuple(PUNCTUATION)
+_SINGLE_QUOTES = tuple(SINGLE_QUOTES)
+_NODE_DISTINGUISHERS = frozenset(NODE_DISTINGUISHERS)
+_FAKE_PROPER_NOUNS = frozenset(FAKE_PROPER_NOUNS)
+_JOINERS = frozenset(JOINERS)
+_PUNCTUATION_SET = frozenset(PUNCTUATION)
+_LEADING_MARKS = frozenset(SENTENCE_INTERRUPTORS + SINGLE_QUOTES) # every character punctuation_parse can strip from the start of a word
+_TRAILING_MARKS = frozenset(mark for mark in SENTENCE_INTERRUPTORS + ELLIPSES + PUNCTUATION + SINGLE_QUOTES if len(mark) == 1) # ...or from its last two characters
+
+
 def text_preprocess(text):
-    for seperator in WORD_SEPERATORS:
+    text = text.translate(_WORD_SEPERATOR_TABLE) # replaces every single-character seperator in one pass
+    for seperator in _LONG_WORD_SEPERATORS:
         text = text.replace(seperator, ' ')
 
     words = text.split(' ')
@@ -20,61 +42,15 @@ def remove_zero_length_strings(list_of_strings):
 def punctuation_parse(words):
     ret = []
     for word in words:
-        parsed_word = word
-        split_at_beginning = False
-        split_at_end = False
-
-        if len(word) < 2 or word in NODE_DISTINGUISHERS: # one-length words not only are definitely not proper nouns, they also break [-2] checks:
+        if len(word) < 2 or word in _NODE_DISTINGUISHERS: # one-length words not only are definitely not proper nouns, they also break [-2] checks:
             ret.append(word)
             continue # so just add it and skip to the next word
 
-        for interruptor in SENTENCE_INTERRUPTORS:
-            try:
-                if parsed_word[0] == interruptor:
-                    parsed_word = parsed_word[1:]
-                    split_at_beginning = True
-                if parsed_word[-2] == interruptor:
-                    parsed_word = parsed_word [:-2] # catches things like Here's how he's "like Biden":
-                    split_at_end = True
-                elif parsed_word[-1] == interruptor:
-                    parsed_word = parsed_word[:-1]
-                    split_at_end = True
-            except IndexError:
-                pass
-
-        for ellipse in ELLIPSES:
-            try:
-                if parsed_word[-len(ellipse):] == ellipse:
-                    parsed_word = parsed_word[-len(ellipse):]
-                    split_at_end = True
-            except IndexError: # if the word isnt long enough to fit an ellipse
-                pass # its not the end of the world
-
-        for punctuation_mark in PUNCTUATION: # only have to check the end of the word for punctuation
-            try:
-                if parsed_word[-1] == punctuation_mark and len(word) > 2: # a single letter followed by punctuation is usually an initial, not a sentence split
-                    parsed_word = parsed_word[:-1]
-                    split_at_end = True
-                elif parsed_word[-2] == punctuation_mark: # catches things like 'Dreamers,' = > ["Dreamers"] and not ["Dreamers,"]
-                    parsed_word = parsed_word[:-2]
-                    split_at_end = True
-            except IndexError: # if the word is under two characters long
-                pass # were done here
-
-        for single_quote in SINGLE_QUOTES: # we have to parse these seperately because of possessives
-            try:
-                if parsed_word[0] == single_quote:  # if it begins in a single quote, its probably the start of quoted text
-                    parsed_word = parsed_word[1:]
-                    split_at_beginning = True
-                if parsed_word[-2:] == (single_quote + "s"):  # if the word ends in 's, it's probably a possessive
-                    parsed_word = parsed_word[:-2] # add it back to that list with the possessive removed
-                    split_at_end = True # so that "Trump's Ford" gets parsed as ["Trump, Ford"] and not ["Trump Ford"]
-                elif parsed_word[-1] == single_quote:  # if it just ends in a single quote, it might be a possessive or the end of quoted text
-                    parsed_word = parsed_word[:-1]  # so just remove the quote and see how it parses without it
-                    split_at_end = True # either of those would end a thought chunk, though
-            except IndexError: # if the word isnt long enough to fit some single quotes
-                pass # its not the end of the world
+        if word[0] not in _LEADING_MARKS and word[-1] not in _TRAILING_MARKS and word[-2] not in _TRAILING_MARKS: # most words have no punctuation at all,
+            ret.append(word) # and every check below looks at one of those three characters
+            continue
 
+        split_at_beginning, parsed_word, split_at_end = parse_word_punctuation(word)
         if split_at_beginning:
             ret.append(PUNCTUATION_REPLACEMENT)
         ret.append(parsed_word)
@@ -84,6 +60,58 @@ def punctuation_parse(words):
     return ret
 
 
+@lru_cache(maxsize=const.PUNCTUATED_WORD_CACHE_MAX_ENTRIES) # punctuated words like "said," and "Trump's" repeat constantly
+def parse_word_punctuation(word): # returns (split_at_beginning, parsed_word, split_at_end)
+    parsed_word = word
+    split_at_beginning = False
+    split_at_end = False
+
+    for interruptor in _SENTENCE_INTERRUPTORS:
+        if not parsed_word:
+            continue
+        if parsed_word[0] == interruptor:
+            parsed_word = parsed_word[1:]
+            split_at_beginning = True
+        if len(parsed_word) < 2:
+            continue
+        if parsed_word[-2] == interruptor:
+            parsed_word = parsed_word[:-2] # catches things like Here's how he's "like Biden":
+            split_at_end = True
+        elif parsed_word[-1] == interruptor:
+            parsed_word = parsed_word[:-1]
+            split_at_end = True
+
+    for ellipse in _ELLIPSES:
+        if parsed_word.endswith(ellipse):
+            parsed_word = ellipse # the word is dropped and only the ellipse kept; this has always been the behaviour
+            split_at_end = True
+
+    for punctuation_mark in _PUNCTUATION: # only have to check the end of the word for punctuation
+        if not parsed_word:
+            continue
+        if parsed_word[-1] == punctuation_mark and len(word) > 2: # a single letter followed by punctuation is usually an initial, not a sentence split
+            parsed_word = parsed_word[:-1]
+            split_at_end = True
+        elif len(parsed_word) > 1 and parsed_word[-2] == punctuation_mark: # catches things like 'Dreamers,' = > ["Dreamers"] and not ["Dreamers,"]
+            parsed_word = parsed_word[:-2]
+            split_at_end = True
+
+    for single_quote in _SINGLE_QUOTES: # we have to parse these seperately because of possessives
+        if not parsed_word:
+            continue
+        if parsed_word[0] == single_quote:  # if it begins in a single quote, its probably the start of quoted text
+            parsed_word = parsed_word[1:]
+            split_at_beginning = True
+        if parsed_word[-2:] == (single_quote + "s"):  # if the word ends in 's, it's probably a possessive
+            parsed_word = parsed_word[:-2] # add it back to that list with the possessive removed
+            split_at_end = True # so that "Trump's Ford" gets parsed as ["Trump, Ford"] and not ["Trump Ford"]
+        elif parsed_word and parsed_word[-1] == single_quote:  # if it just ends in a single quote, it might be a possessive or the end of quoted text
+            parsed_word = parsed_word[:-1]  # so just remove the quote and see how it parses without it
+            split_at_end = True # either of those would end a thought chunk, though
+
+    return split_at_beginning, parsed_word, split_at_end
+
+
 def too_many_capitalized_words(words):
     total_actual_words = 0  # count all the words that arent PUNCTUATION_REPLACEMENT
     uppercase_words = 0  # |
@@ -92,67 +120,233 @@ def too_many_capitalized_words(words):
             if ord(word[0]) < UPPERCASE_ASCII_VALUES_UPPER_BOUND:  # if the first letters' ascii value is in the capital range
                 uppercase_words += 1
             total_actual_words += 1
+    if total_actual_words == 0: # nothing but punctuation, i.e. a text of just quotes
+        return False
     return (uppercase_words / total_actual_words) >= UPPERCASE_WORD_GARBAGE_THRESHHOLD
 
 
 def proper_noun_final_pass(list_of_proper_nouns):
+    ret = []
+    replacements = [] # fixed-up nouns go at the end of the list, as they always have
     for noun in list_of_proper_nouns:
-        noun_is_safe = False # if the noun is replaced by a Problem Phrase replacement, we know it wont end with a joiner; this tracks that
-        for problem_phrase in [*PROBLEM_PHRASES]: # PROBLEM_WORDS is a dictionary of (what nltk usually picks up, what the proper noun actually is) pairs
-            if noun  == problem_phrase:  # if we find one of those alone in the list of proper nouns,
-                list_of_proper_nouns.remove(problem_phrase) # it was probably supposed to be the problem word
-                list_of_proper_nouns.append(PROBLEM_PHRASES[noun])
-                noun_is_safe = True # avoid KeyError below when the word is both a problem word and has a joiner
+        fixed_noun = fix_proper_noun(noun)
+        if fixed_noun == noun:
+            ret.append(noun)
+        else:
+            replacements.append(fixed_noun)
 
-        for joiner in JOINERS:
-            if noun_is_safe:
-                break
+    return ret + replacements
 
-            words = noun.split(' ')
-            if words[-1] == joiner:
-                list_of_proper_nouns.remove(noun)
-                list_of_proper_nouns.append(' '.join(words[:-1]))
 
-    return list_of_proper_nouns
+def fix_proper_noun(noun):
+    while True:
+        if noun in PROBLEM_PHRASES: # PROBLEM_PHRASES is a dictionary of (what nltk usually picks up, what the proper noun actually is) pairs
+            return PROBLEM_PHRASES[noun] # a replacement never ends with a joiner, so were done
 
+        words = noun.split(' ')
+        if words[-1] not in _JOINERS:
+            return noun
+        noun = ' '.join(words[:-1]) # "Ministry of" => "Ministry", which might be a problem phrase itself
 
-def extract_proper_nouns_from_text(text):
-    ret = []
-    consecutive_proper_nouns = [] # holds consecutive proper nouns, since theyre usually actually one big proper noun
-    last_word_was_proper_noun = False
 
-    words = text_preprocess(text)
+class ProperNounMerger(object):
+    def __init__(self, case_sensitive=False):
+        """
+            Collects proper nouns, merging any that contain one another (i.e. "Trump" and "Donald Trump") into whichever
+            select_better_proper_noun_from prefers.
+
+            Nouns are indexed by their words, so each new noun is only compared against the nouns it shares a word with
+            rather than against every noun so far.
+        """
+        self.case_sensitive = case_sensitive
+        self.__order = {} # noun -> the order it was added in; dicts keep insertion order, so this doubles as the noun list
+        self.__nouns_by_word = {} # comparison-form word -> set of nouns containing it
+        self.__added = 0
+
+    def add(self, proper_noun): # returns the noun now standing for proper_noun, which may be an older, better one
+        comparable_noun = self.__comparable(proper_noun)
+        candidates = set()
+        for word in comparable_noun.split(' '):
+            candidates.update(self.__nouns_by_word.get(word, ()))
+
+        for older_proper_noun in sorted(candidates, key=self.__order.__getitem__): # oldest first, like a plain scan would
+            comparable_older_proper_noun = self.__comparable(older_proper_noun)
+            if comparable_noun in comparable_older_proper_noun or comparable_older_proper_noun in comparable_noun: # if either of these proper nouns should include each other
+                if select_better_proper_noun_from(comparable_noun, comparable_older_proper_noun) == comparable_older_proper_noun: # and we decide to keep the old one:
+                    return older_proper_noun # don't add this one too
+                self.remove(older_proper_noun) # we dont need that old one anymore
+
+        self.__order[proper_noun] = self.__added
+        self.__added += 1
+        for word in comparable_noun.split(' '):
+            self.__nouns_by_word.setdefault(word, set()).add(proper_noun)
+        return proper_noun
+
+    def remove(self, proper_noun):
+        del self.__order[proper_noun]
+        for word in self.__comparable(proper_noun).split(' '):
+            nouns_with_word = self.__nouns_by_word[word]
+            nouns_with_word.discard(proper_noun)
+            if not nouns_with_word:
+                del self.__nouns_by_word[word]
+
+    def proper_nouns(self):
+        return list(self.__order)
+
+    def __contains__(self, proper_noun):
+        return proper_noun in self.__order
+
+    def __len__(self):
+        return len(self.__order)
+
+    def __comparable(self, proper_noun):
+        return proper_noun if self.case_sensitive else proper_noun.lower() # compare lowercases, so New York and New york arent taken as separates
+
+
+_tagger = None
 
+
+def get_tagger(): # nltk.pos_tag builds a new tagger (and reloads its model) on every call, so keep one around instead
+    global _tagger
+    if _tagger is None:
+        _tagger = PerceptronTagger()
+    return _tagger
+
+
+def make_proper_noun_process_pool(max_workers=None): # each worker loads its tagger as it starts, rather than on its first batch
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=get_tagger)
+
+
+def words_to_tag(text): # returns the preprocessed words of the text, or None if theres no point tagging them
+    words = text_preprocess(text)
+    if all(word == PUNCTUATION_REPLACEMENT for word in words): # no words at all, or only punctuation
+        return None
     if too_many_capitalized_words(words): # if too many of the words in the text are capitalized
-        return [] # the proper noun extractor wont get anything useful out of it
+        return None # the proper noun extractor wont get anything useful out of it
+    return words
+
+
+def extract_proper_nouns_from_text(text, use_cache=True):
+    if use_cache:
+        cached_proper_nouns = proper_noun_cache.get(text)
+        if cached_proper_nouns is not None:
+            return cached_proper_nouns
+
+    words = words_to_tag(text)
+    proper_nouns = [] if words is None else proper_nouns_from_tagged_words(get_tagger().tag(words))
+    if use_cache:
+        proper_noun_cache.put(text, proper_nouns)
+    return proper_nouns
+
+
+def extract_proper_nouns_batch(texts, use_cache=True): # returns one list of proper nouns per text, tagging all of them in a single pass
+    if not use_cache:
+        return _extract_proper_nouns_batch(texts)
+
+    ret = [proper_noun_cache.get(text) for text in texts]
+    missing_texts = list(OrderedDict.fromkeys(text for text, proper_nouns in zip(texts, ret) if proper_nouns is None)) # each distinct text only gets tagged once
+    extracted = dict(zip(missing_texts, _extract_proper_nouns_batch(missing_texts)))
+    for text, proper_nouns in extracted.items():
+        proper_noun_cache.put(text, proper_nouns)
+
+    return [proper_nouns if proper_nouns is not None else list(extracted[text]) for text, proper_nouns in zip(texts, ret)]
+
+
+def _extract_proper_nouns_batch(texts):
+    ret = [[] for _ in texts]
+    indices_to_tag = []
+    sentences_to_tag = []
+    for i, text in enumerate(texts):
+        words = words_to_tag(text) if text else None
+        if words is not None:
+            indices_to_tag.append(i)
+            sentences_to_tag.append(words)
+
+    for i, tagged_words in zip(indices_to_tag, get_tagger().tag_sents(sentences_to_tag)):
+        ret[i] = proper_nouns_from_tagged_words(tagged_words)
+
+    return ret
+
+
+class ProperNounCache(object):
+    def __init__(self, max_entries=const.PROPER_NOUN_CACHE_MAX_ENTRIES):
+        """
+            A size-bounded LRU memo of extract_proper_nouns_from_text, keyed on a hash of the text rather than the text itself.
+            Syndicated stories repeat the same titles and descriptions across outlets, so most lookups hit.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict() # text hash -> tuple of proper nouns, oldest use first
+
+    def get(self, text): # returns a fresh list of the texts proper nouns, or None if it hasnt been seen
+        key = text_hash(text)
+        proper_nouns = self.__entries.get(key)
+        if proper_nouns is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        return list(proper_nouns) # callers are free to modify what they get back
+
+    def put(self, text, proper_nouns):
+        key = text_hash(text)
+        self.__entries[key] = tuple(proper_nouns)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def clear(self):
+        self.__entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def save(self, path):
+        with open(path, "w", encoding=const.TEXT_ENCODING_FORMAT) as f:
+            json.dump([[key, list(proper_nouns)] for key, proper_nouns in self.__entries.items()], f) # a list, so the LRU order survives
+
+    def load(self, path):
+        with open(path, "r", encoding=const.TEXT_ENCODING_FORMAT) as f:
+            for key, proper_nouns in json.load(f):
+                self.__entries[key] = tuple(proper_nouns)
+                self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.__entries), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode(const.TEXT_ENCODING_FORMAT), digest_size=16).hexdigest()
+
+
+proper_noun_cache = ProperNounCache() # shared by the whole process
+
+
+def proper_nouns_from_tagged_words(tagged_words):
+    merger = ProperNounMerger()
+    consecutive_proper_nouns = [] # holds consecutive proper nouns, since theyre usually actually one big proper noun
+    last_word_was_proper_noun = False
 
-    for word, tag in nltk.pos_tag(words): # split the text using NLTK classification, then iterate over each word
-        this_word_is_proper_noun = (tag == "NNP" and word != PUNCTUATION_REPLACEMENT and word not in FAKE_PROPER_NOUNS)
+    for word, tag in tagged_words: # iterate over each word and its NLTK classification
+        this_word_is_proper_noun = (tag == "NNP" and word != PUNCTUATION_REPLACEMENT and word not in _FAKE_PROPER_NOUNS)
 
         if last_word_was_proper_noun and not this_word_is_proper_noun: # if this word ends a sentence or a chunk of proper nouns
-            if word in JOINERS: # but could be used to connect two of them (i.e. Ministry 'of' State)
+            if word in _JOINERS: # but could be used to connect two of them (i.e. Ministry 'of' State)
                 consecutive_proper_nouns.append(word)
             else: # otherwise, we just ended a chunk of proper nouns
-                if consecutive_proper_nouns[-1] in JOINERS: # 'informed Theresa May of his intentions" => "Theresa May" and not "Theresa May of"
+                if consecutive_proper_nouns[-1] in _JOINERS: # 'informed Theresa May of his intentions" => "Theresa May" and not "Theresa May of"
                     consecutive_proper_nouns = consecutive_proper_nouns[:-1]
 
                 if len(consecutive_proper_nouns) > 6: # no reasonable proper nouns are this long
                     continue
 
-                proper_noun = ' '.join(consecutive_proper_nouns)
-                lower_proper_noun = proper_noun.lower() # compare lowercases, so New York and New york arent taken as separates
-
-                proper_noun_is_new = True
-                for older_proper_noun in ret:
-                    lower_older_proper_noun = older_proper_noun.lower()
-                    if lower_proper_noun in lower_older_proper_noun or lower_older_proper_noun in lower_proper_noun: # if either of these proper nouns should include each other
-                        if select_better_proper_noun_from(lower_proper_noun, lower_older_proper_noun) == lower_older_proper_noun: # and we decide to keep the old one:
-                            proper_noun_is_new = False # don't add this one too
-                            break # no point seeing if we can add it, now that we know we wont
-                        else:
-                            ret.remove(older_proper_noun) # we dont need that old one anymore
-                if proper_noun_is_new:
-                    ret.append(proper_noun)
+                merger.add(' '.join(consecutive_proper_nouns)) # keeps whichever of this and any overlapping older noun is better
 
                 consecutive_proper_nouns = [] # dont concatenate all the nouns in the article please
                 last_word_was_proper_noun = False
@@ -160,7 +354,7 @@ def extract_proper_nouns_from_text(text):
             if word.isupper() and len(word) > 2: # temporary fix (hahaa) to avoid fucking up too many acronyms
                 word = word.lower().capitalize() # EUROPE -> Europe
 
-            if word in PUNCTUATION:
+            if word in _PUNCTUATION_SET:
                 continue # punctuation is not nouns, but nltk seems to disagree
 
             if word in PROBLEM_WORDS: # fixes formatting errors on some common words i.e. U.N. => U.n
@@ -169,6 +363,7 @@ def extract_proper_nouns_from_text(text):
             consecutive_proper_nouns.append(word)
             last_word_was_proper_noun = True
 
+    ret = merger.proper_nouns()
     if consecutive_proper_nouns: # if we ended on a proper noun
         ret.append(' '.join(consecutive_proper_nouns)) # make sure to add that too
 
@@ -1,4 +1,33 @@
-from newsapy.proper_noun_extraction import extract_proper_nouns_from_text, select_better_proper_noun_from
+import aiohttp
+import asyncio
+import cv2
+import io
+import numpy as np
+import os
+import random
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from PIL import Image
+
+from newsapy import const, image_utils, proper_noun_extraction
+from newsapy.const import TAGGERS, NEWS_SIGNATURES, PUNCTUATION_REPLACEMENT, NODE_DISTINGUISHERS, PUNCTUATION, SENTENCE_INTERRUPTORS, SINGLE_QUOTES, ELLIPSES, WORD_SEPERATORS
+from newsapy.entity_index import EntityIndex
+from newsapy.image_store import ImageStore
+from newsapy.image_utils import ImageFailureCache, ImagePipeline, ImageResult, IMAGE_CONNECTION_ERROR, IMAGE_DECODE_ERROR, IMAGE_HTTP_ERROR, IMAGE_TIMEOUT, decode_image, decode_resize_and_save, fetch_and_resize_image, resize_all, sniff_image
+from newsapy.newsapi_article import NewsArticle, add_news_signatures, format_text, parse_newsapi_time, parse_newsapi_times
+from newsapy.newsapi_article_batch import NewsArticleBatch
+from newsapy.newsapi_article_export import read_ndjson, write_ndjson
+from newsapy.newsapi_client import NewsApiClient
+from newsapy.newsapi_disk_cache import DiskResponseCache
+from newsapy.newsapi_key_pool import KeyPool
+from newsapy.newsapi_request_scheduler import RequestScheduler
+from newsapy.newsapi_response_cache import ResponseCache
+from newsapy.near_duplicate_index import NearDuplicateIndex
+from newsapy.newsapi_retry_policy import NewsApiError, RetryPolicy, GIVE_UP, RETRY_AFTER_BACKOFF, RETRY_WITH_ANOTHER_KEY
+from newsapy.proper_noun_extraction import ProperNounCache, ProperNounMerger, extract_proper_nouns_batch, extract_proper_nouns_from_text, proper_noun_cache, proper_noun_final_pass, select_better_proper_noun_from, text_preprocess
 
 
 def select_better_proper_noun_from_tests():
@@ -17,5 +46,821 @@ def select_better_proper_noun_from_tests():
     # accumulation
     assert extract_proper_nouns_from_text("Trump took his friend Donald Trump to President Donald Trump's favorite McDonalds.") == ["Donald Trump", "McDonalds"]
 
+    # texts of nothing but punctuation have no proper nouns, and don't spoil a batch they're in
+    assert extract_proper_nouns_from_text("“”", use_cache=False) == [] and extract_proper_nouns_from_text('("', use_cache=False) == []
+    assert extract_proper_nouns_batch(["Angela Merkel visits Paris", "“”"], use_cache=False) == [["Angela Merkel", "Paris"], []]
+
+def proper_noun_merger_tests():
+    # smaller versions are merged into the better noun, whichever order they arrive in
+    merger = ProperNounMerger()
+    for proper_noun in ["Trump", "Angela Merkel", "Donald Trump", "Merkel", "new york", "New York"]:
+        merger.add(proper_noun)
+    assert merger.proper_nouns() == ["Angela Merkel", "Donald Trump", "new york"]
+
+    # case sensitive merging keeps differently-cased nouns apart
+    merger = ProperNounMerger(case_sensitive=True)
+    merger.add("new york")
+    merger.add("New York")
+    assert len(merger) == 2
+
+    # problem phrases and trailing joiners are fixed, even when they're next to each other
+    assert proper_noun_final_pass(["House of", "Ministry of", "United", "Paris"]) == ["Paris", "House of Representatives", "Ministry", "United States"]
+
+
+def make_article(title, published_at, proper_nouns, source="Reuters"):
+    article = NewsArticle(None, {"source": {"name": source}, "author": None, "url": "https://example.com/" + title, "publishedAt": published_at,
+                                 "urlToImage": None, "title": title, "description": None, "content": None})
+    article.set_proper_nouns(proper_nouns, []) # skip nltk, so these tests dont need a tagger
+    return article
+
+
+def entity_index_tests():
+    index = EntityIndex()
+    index.add_all([
+        make_article("a", "2019-06-01T10:00:00Z", ["Trump", "Xi Jinping"]),
+        make_article("b", "2019-06-02T10:00:00Z", ["Donald Trump", "Osaka"]),
+        make_article("c", "2019-06-03T10:00:00Z", ["Xi Jinping", "Osaka"]),
+    ])
+
+    # variants across articles fold into one entity, named by the best variant
+    assert index.canonical_name("trump") == "Donald Trump"
+    assert sorted(article.title for article in index.articles_mentioning("Trump")) == ["a", "b"]
+    assert len(index) == 3 and "Nobody" not in index
+
+    # frequency, time windows and co-occurrence
+    assert index.top_entities(2) in ([("Donald Trump", 2), ("Xi Jinping", 2)], [("Xi Jinping", 2), ("Donald Trump", 2)])
+    assert index.top_entities(1, start=datetime(2019, 6, 2)) == [("Osaka", 2)]
+    assert dict(index.cooccurrences("Osaka")) == {"Donald Trump": 1, "Xi Jinping": 1}
+
+    # adding the same article twice doesn't count it twice
+    assert not index.add(make_article("a", "2019-06-01T10:00:00Z", ["Trump", "Xi Jinping"]))
+
+
+def format_text_tests():
+    texts = ["Trump says tariffs stay - CNN", "Stocks rally | TheHill", "NY POST: big news\r ads", "Read more - Fox News - CNN", "Visit Business Insider\xa0now", "Nothing to strip"]
+    for text in texts: # the compiled signatures strip exactly what the old loop of str.replace did
+        legacy_text = text.split('\r')[0].replace("\xa0", " ")
+        for signature in NEWS_SIGNATURES:
+            legacy_text = legacy_text.replace(signature, "")
+        assert format_text(text) == legacy_text.strip()
+
+    # signatures added at runtime are stripped too, and longer signatures win over their prefixes
+    add_news_signatures(" - The Test Gazette", " - The Test Gazette Weekly")
+    assert format_text("Local team wins - The Test Gazette Weekly") == "Local team wins"
+    assert format_text("Local team wins - The Test Gazette - CNN") == "Local team wins"
+
+
+def lazy_article_tests():
+    article_json = {"source": {"name": "CNN"}, "author": None, "url": "https://cnn.com/a", "publishedAt": "2019-06-01T10:00:00Z",
+                    "urlToImage": "https://cnn.com/a.jpg", "title": "Trump says tariffs stay - CNN", "description": "A\xa0description", "content": "text"}
+    eager_article = NewsArticle(None, article_json)
+    lazy_article = NewsArticle(None, article_json, lazy=True)
+    assert (lazy_article.url, lazy_article.source) == (eager_article.url, eager_article.source)
+    assert lazy_article.to_dict() == eager_article.to_dict()
+    assert NewsArticle(None, article_json, keep_content=False, lazy=True).content == ""
+
+    # setting a text field formats the rest first, so the other fields aren't lost
+    lazy_article = NewsArticle(None, article_json, lazy=True)
+    lazy_article.title = "A new title"
+    assert (lazy_article.title, lazy_article.description) == ("A new title", "A description")
+
+    garbage_json = dict(article_json, url="https://www.youtube.com/watch?v=1")
+    assert NewsArticle(None, garbage_json, lazy=True).to_dict() == NewsArticle(None, garbage_json).to_dict()
+
+
+def parse_newsapi_time_tests():
+    assert parse_newsapi_time("2019-06-01T10:00:00Z") == datetime(2019, 6, 1, 10)
+    assert parse_newsapi_time("2019-06-01T10:00:00.123456Z") == datetime(2019, 6, 1, 10)
+    assert parse_newsapi_time("2019-06-01T10:00:00+05:30") == datetime(2019, 6, 1, 4, 30) # offsets are converted to UTC, not dropped
+    assert parse_newsapi_time("2019-06-01T23:00:00-0400") == datetime(2019, 6, 2, 3)
+    assert parse_newsapi_time(None) is None
+
+    # the batch parser agrees with the single one, fast path or not
+    time_strings = ["2019-06-01T10:00:00Z", "2019-06-01T10:00:00.5+01:00", None]
+    times_published = parse_newsapi_times(time_strings)
+    assert list(times_published[:2].astype(datetime)) == [parse_newsapi_time(time_string) for time_string in time_strings[:2]]
+    assert str(times_published[2]) == "NaT"
+
+
+def news_article_batch_tests():
+    reply_json = {"articles": [
+        {"source": {"name": "CNN"}, "author": None, "url": "https://cnn.com/b", "publishedAt": "2019-06-02T10:00:00Z", "urlToImage": None,
+         "title": "Second story - CNN", "description": "b", "content": None},
+        {"source": {"name": "Reuters"}, "author": "Jane Doe", "url": "https://reuters.com/a", "publishedAt": "2019-06-01T10:00:00Z", "urlToImage": "https://reuters.com/a.jpg",
+         "title": "First story", "description": "a", "content": "text"},
+        {"source": {"name": "CNN"}, "author": None, "url": "https://cnn.com/b2", "publishedAt": "2019-06-03T10:00:00Z", "urlToImage": None,
+         "title": "Second story", "description": "b again", "content": None},
+    ]}
+    batch = NewsArticleBatch.from_reply_json(reply_json)
+
+    # rows materialize into the same NewsArticles the client would have built
+    article = batch[1]
+    expected_article = NewsArticle(None, reply_json["articles"][1])
+    assert (article.title, article.uid, article.time_published, article.image_url) == (expected_article.title, expected_article.uid, expected_article.time_published, expected_article.image_url)
+    assert batch[0].title == "Second story" and batch[0].authors is None
+
+    # sorting, windowing, source filters and dedup work on the columns
+    assert batch.sort_by_time().column("url") == ["https://reuters.com/a", "https://cnn.com/b", "https://cnn.com/b2"]
+    assert batch.published_between(start=datetime(2019, 6, 2)).column("url") == ["https://cnn.com/b", "https://cnn.com/b2"]
+    assert batch.from_sources("Reuters").column("title") == ["First story"]
+    assert batch.deduplicate().column("url") == ["https://cnn.com/b", "https://reuters.com/a"]
+    assert len(NewsArticleBatch.concatenate([batch, batch.take([1])]).from_sources("Reuters")) == 2
+
+
+def article_export_tests():
+    articles = [make_article("Story {}".format(i), "2019-06-0{}T10:00:00Z".format(i + 1), ["Story"]) for i in range(3)]
+    articles.append(NewsArticle(None, {"source": {"name": "CNN"}, "author": "Jane Doe", "url": "https://cnn.com/a", "publishedAt": "2019-06-01T10:00:00+05:30",
+                                       "urlToImage": None, "title": "Untagged story - CNN", "description": None, "content": "text"}))
+
+    # articles survive the round trip through ndjson, proper nouns and all
+    with tempfile.TemporaryDirectory() as directory:
+        path = directory + "/articles.ndjson.gz"
+        assert write_ndjson(articles, path) == 4
+        loaded_articles = list(read_ndjson(path))
+    assert [article.to_dict() for article in loaded_articles] == [article.to_dict() for article in articles]
+    assert loaded_articles[0].all_proper_nouns == ["Story"]
+    assert loaded_articles[3].time_published == datetime(2019, 6, 1, 4, 30)
+
+    # and so do batches through their binary columns
+    batch = NewsArticleBatch.from_articles(articles)
+    f = io.BytesIO()
+    batch.save(f)
+    f.seek(0)
+    loaded_batch = NewsArticleBatch.load(f)
+    assert [loaded_batch.article_json(i) for i in range(4)] == [batch.article_json(i) for i in range(4)]
+    assert loaded_batch.source_names == batch.source_names
+
+
+def near_duplicate_index_tests():
+    def story(title, description, source):
+        return NewsArticle(None, {"source": {"name": source}, "author": None, "url": "https://{}.com/{}".format(source, title), "publishedAt": None,
+                                  "urlToImage": None, "title": title, "description": description, "content": None})
+
+    description = "The Federal Reserve left its benchmark interest rate unchanged on Wednesday, saying inflation had eased but remained above its 2 percent target."
+    original = story("Federal Reserve holds interest rates steady as inflation cools", description, "Reuters")
+    index = NearDuplicateIndex()
+    assert index.add(original) is None
+
+    # re-titled and truncated versions of the same story are found; a different story isn't
+    assert index.add(story("Federal Reserve holds interest rates steady as inflation cools | Fox Business", description, "Fox Business")) is original
+    assert index.add(story("Fed holds interest rates steady as inflation cools", description[:100], "CNBC")) is original
+    other = story("Apple unveils new iPhone with a faster chip", "The company said the device would ship next month, priced from 799 dollars.", "The Verge")
+    assert index.find(other) is None
+    assert list(index.unique([other, story("Apple unveils new iPhone with a faster chip", other.description, "Engadget")])) == [other]
+    assert (len(index), index.story_size(original), index.duplicates) == (2, 3, 3)
+
+
+def image_pipeline_tests():
+    image = np.zeros((60, 80, 3), dtype=np.uint8)
+    image[:, :40] = 255
+    _, encoded = cv2.imencode(".png", image)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # dimensions are (width, height), and None keeps the original size
+        path = decode_resize_and_save(encoded.tobytes(), (40, 30), "thumbnail", save_path=directory, filetype="png")
+        assert cv2.imread(path).shape == (30, 40, 3)
+        assert cv2.imread(decode_resize_and_save(encoded.tobytes(), None, "original", save_path=directory, filetype="png")).shape == (60, 80, 3)
+        assert decode_resize_and_save(b"not an image", None, "broken", save_path=directory) is None
+
+        async def resize_on_pipeline():
+            pipeline = ImagePipeline(session=None)
+            try:
+                return await pipeline.resize_file(path, (20, 10), "smaller", save_path=directory), await pipeline.resize_file_all(path, [(20, 10), (4, 2)], "thumbnail", save_path=directory)
+            finally:
+                pipeline.close()
+        smaller_path, thumbnail_paths = asyncio.get_event_loop().run_until_complete(resize_on_pipeline())
+        assert cv2.imread(smaller_path).shape == (10, 20, 3)
+        assert {dimensions: cv2.imread(thumbnail_path).shape[:2] for dimensions, thumbnail_path in thumbnail_paths.items()} == {(20, 10): (10, 20), (4, 2): (2, 4)}
+        assert thumbnail_paths[(4, 2)].endswith("thumbnail_4x2.jpeg")
+
+    # every size comes out of one resize_all, largest first, whatever order they're asked for in
+    resized = resize_all(image, [(8, 6), None, (40, 30), (100, 75)])
+    assert [(dimensions, made.shape[:2]) for dimensions, made in resized.items()] == [(None, (60, 80)), ((100, 75), (75, 100)), ((40, 30), (30, 40)), ((8, 6), (6, 8))]
+
+
+def sniff_image_tests():
+    image = np.zeros((48, 64, 3), dtype=np.uint8)
+    for extension, image_format in ((".jpg", "jpeg"), (".png", "png"), (".bmp", "bmp"), (".webp", "webp")):
+        encoded = cv2.imencode(extension, image)[1].tobytes()
+        assert sniff_image(encoded) == (image_format, 64, 48)
+    gif = io.BytesIO()
+    Image.new("RGB", (64, 48)).save(gif, format="GIF")
+    assert sniff_image(gif.getvalue()) == ("gif", 64, 48)
+
+    # error pages and truncated headers
+    assert sniff_image(b"<!DOCTYPE html><html>") is None
+    assert sniff_image(cv2.imencode(".png", image)[1].tobytes()[:12]) == ("png", None, None)
+
+    # images are decoded at a reduced size when every thumbnail fits in it
+    encoded = cv2.imencode(".jpg", np.zeros((400, 800, 3), dtype=np.uint8))[1].tobytes()
+    assert decode_image(encoded).shape == (400, 800, 3)
+    assert decode_image(encoded, largest_size=(200, 100)).shape == (100, 200, 3)
+    assert decode_image(encoded, largest_size=(201, 100)).shape == (200, 400, 3)
+
+
+def image_result_tests():
+    loop = asyncio.get_event_loop()
+    cache = ImageFailureCache(ttl=60, transient_ttl=0)
+
+    # dead links are remembered, but timeouts and 5xxs can be left to clear up
+    cache.put(ImageResult(IMAGE_HTTP_ERROR, "gone", status=404))
+    cache.put(ImageResult(IMAGE_HTTP_ERROR, "overloaded", status=503))
+    cache.put(ImageResult(IMAGE_TIMEOUT, "slow"))
+    assert "gone" in cache and "overloaded" not in cache and "slow" not in cache
+    assert cache.get("gone").cached and cache.get("gone").status == 404 and not cache.get("gone")
+
+    # failed fetches come back as results rather than exceptions, and aren't sent again while they're remembered
+    async def fetch_twice(url):
+        async with aiohttp.ClientSession() as session:
+            pipeline = ImagePipeline(session)
+            try:
+                return await pipeline.fetch_image(url, "refused", [None]), await pipeline.fetch_image(url, "refused", [None]), pipeline.stats()
+            finally:
+                pipeline.close()
+    first, second, stats = loop.run_until_complete(fetch_twice("http://127.0.0.1:1/image.jpg")) # nothing listens on port 1
+    assert first.outcome == IMAGE_CONNECTION_ERROR and not first.cached and first.path is None
+    assert second.outcome == IMAGE_CONNECTION_ERROR and second.cached
+    assert stats == {"outcomes": {IMAGE_CONNECTION_ERROR: 2}, "failures_remembered": 1, "failed_urls": 1}
+
+    # callers without a pipeline share one per session, so its download limit holds across their calls
+    async def fetch_without_pipeline(url):
+        async with aiohttp.ClientSession() as session:
+            results = [await fetch_and_resize_image(session, url, "refused") for _ in range(2)]
+            return results, image_utils._default_pipeline(session)
+    (first, second), pipeline = loop.run_until_complete(fetch_without_pipeline("http://127.0.0.1:1/other.jpg"))
+    assert first.outcome == IMAGE_CONNECTION_ERROR and second.cached and pipeline.outcomes[IMAGE_CONNECTION_ERROR] == 2
+
+    # a full-sized copy that has gone missing is downloaded again, rather than failing every size made from it
+    downloads = []
+
+    async def reply(url, params):
+        downloads.append(url)
+        return cv2.imencode(".jpg", np.zeros((60, 80, 3), dtype=np.uint8))[1].tobytes()
+
+    with tempfile.TemporaryDirectory() as directory:
+        client = make_stub_client(directory, reply)
+        client.image_pipeline.session = client.http_session
+        article = NewsArticle(client, {"source": {"name": "Reuters"}, "author": None, "url": "https://example.com/a", "publishedAt": None,
+                                       "urlToImage": "https://example.com/a.jpg", "title": "A story", "description": None, "content": None})
+        full_path = loop.run_until_complete(article.images_async([None], save_path=directory))[None]
+        os.remove(full_path)
+        result = loop.run_until_complete(article.image_result_async([(40, 30)], save_path=directory))
+        assert result.ok and len(downloads) == 2
+
+        # so is a size made before, from the full-sized copy
+        os.remove(result.paths[(40, 30)])
+        result = loop.run_until_complete(article.image_result_async([(40, 30)], save_path=directory))
+        assert result.ok and os.path.exists(result.paths[(40, 30)]) and len(downloads) == 2
+
+        # a damaged full-sized copy fails once, then is downloaded again
+        with open(full_path, "wb") as f:
+            f.write(b"not an image")
+        assert loop.run_until_complete(article.image_result_async([(20, 15)], save_path=directory)).outcome == IMAGE_DECODE_ERROR
+        assert loop.run_until_complete(article.image_result_async([(20, 15)], save_path=directory)).ok and len(downloads) == 3
+        client.close()
+
+
+def key_pool_tests():
+    loop = asyncio.get_event_loop()
+    pool = KeyPool(["a", "b", "c"], cooldown=0.05)
+
+    # concurrent requests are spread across keys instead of piling onto one
+    keys = [loop.run_until_complete(pool.acquire()) for _ in range(3)]
+    assert sorted(key.api_key for key in keys) == ["a", "b", "c"]
+
+    # ratelimited keys cool down, rejected keys are dropped for good
+    pool.release(keys[0], status=429, headers={"Retry-After": "60"})
+    pool.release(keys[1], status=401)
+    pool.release(keys[2], status=200)
+    assert loop.run_until_complete(pool.acquire()).api_key == keys[2].api_key
+
+    # with every live key cooling down, acquire waits for the earliest one instead of raising
+    pool.release(keys[2], status=429)
+    assert loop.run_until_complete(pool.acquire()).api_key == keys[2].api_key
+
+    # each key has its own rate limit, so with one key revoked the other still only gets its own share
+    pool = KeyPool(["a", "b"], requests_per_second_per_key=20, burst=1)
+    keys = [loop.run_until_complete(pool.acquire()) for _ in range(2)]
+    pool.release(keys[0], status=401)
+    pool.release(keys[1], status=200)
+    started = time.monotonic()
+    assert all(loop.run_until_complete(pool.acquire()).api_key == keys[1].api_key for _ in range(3))
+    assert time.monotonic() - started >= 0.14 # three more tokens at 20 a second
+
+    # requests waiting for a token get keys in priority order, and in arrival order within a priority
+    served = []
+
+    async def request(name, priority):
+        await pool.acquire(priority)
+        served.append(name)
+
+    loop.run_until_complete(asyncio.gather(*[request(name, priority) for name, priority in [("low", 2), ("normal", 1), ("normal2", 1), ("high", 0)]]))
+    assert served == ["high", "normal", "normal2", "low"]
+
+
+def retry_policy_tests():
+    policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=3, jitter=False)
+
+    # bad requests are never retried, ratelimits switch keys, server errors and timeouts back off
+    assert policy.classify(status=400) == GIVE_UP
+    assert policy.classify(status=429) == RETRY_WITH_ANOTHER_KEY
+    assert policy.classify(status=401) == RETRY_WITH_ANOTHER_KEY
+    assert policy.classify(status=503) == RETRY_AFTER_BACKOFF
+    assert policy.classify(exception=asyncio.TimeoutError()) == RETRY_AFTER_BACKOFF
+
+    # backoff grows exponentially up to max_delay, and attempts are bounded
+    assert [policy.delay(attempt, RETRY_AFTER_BACKOFF) for attempt in range(4)] == [1, 2, 3, 3]
+    assert policy.delay(0, RETRY_WITH_ANOTHER_KEY) == 0
+    assert policy.should_retry(1, RETRY_AFTER_BACKOFF) and not policy.should_retry(2, RETRY_AFTER_BACKOFF)
+
+
+def request_scheduler_tests():
+    loop = asyncio.get_event_loop()
+    scheduler = RequestScheduler(max_in_flight=1)
+    finished = []
+
+    async def request(name, priority):
+        async with scheduler.slot(priority):
+            await asyncio.sleep(0)
+            finished.append(name)
+
+    async def run_all():
+        async with scheduler.slot(1): # hold the only slot while everything else queues up
+            queued = [asyncio.ensure_future(request(name, priority)) for name, priority in [("low", 2), ("normal", 1), ("high", 0), ("normal2", 1)]]
+            await asyncio.sleep(0)
+        await asyncio.gather(*queued)
+
+    # higher priorities go first, and requests of equal priority keep their order
+    loop.run_until_complete(run_all())
+    assert finished == ["high", "normal", "normal2", "low"]
+
+
+def iter_everything_tests():
+    loop = asyncio.get_event_loop()
+    finished_pages = []
+
+    async def reply(url, params): # 450 results, and later pages answer first
+        await asyncio.sleep(0.01 * (6 - params["page"]))
+        finished_pages.append(params["page"])
+        return {"status": "ok", "totalResults": 450, "articles": [{"source": {"name": "Reuters"}, "author": None, "url": "https://example.com/{}/{}".format(params["page"], i),
+                "publishedAt": None, "urlToImage": None, "title": "Story {} of page {}".format(i, params["page"]), "description": None, "content": None} for i in range(params["pageSize"])]}
+
+    async def first_pages(pages, n): # takes n pages, then stops iterating
+        taken = [await pages.__anext__() for _ in range(n)]
+        await pages.aclose()
+        await asyncio.sleep(0.1) # long enough for every page to have finished, had it not been cancelled
+        return taken
+
+    with tempfile.TemporaryDirectory() as directory:
+        client = make_stub_client(directory, reply)
+
+        # the first page comes first, then the rest as they arrive; max_results cuts the page it ends on short
+        pages = loop.run_until_complete(first_pages(client.iter_everything_async(q="x", page_size=100, max_results=250), 3))
+        assert [len(page) for page in pages] == [100, 50, 100] and pages[1][0].title == "Story 0 of page 3"
+
+        # max_pages stops paging whatever totalResults says
+        finished_pages.clear()
+        assert len(loop.run_until_complete(client.get_everything_all_async(q="x", page_size=100, max_pages=2))) == 200 and sorted(finished_pages) == [1, 2]
+
+        # stopping early cancels the pages still downloading
+        finished_pages.clear()
+        loop.run_until_complete(first_pages(client.iter_everything_async(q="x", page_size=100), 2))
+        assert finished_pages == [1, 5]
+        client.close()
+
+
+def stream_requests_tests():
+    loop = asyncio.get_event_loop()
+    finished = []
+
+    async def reply(url, params): # one article per keyword, and shorter keywords answer first
+        await asyncio.sleep(0.01 * len(params["q"]))
+        finished.append(params["q"])
+        return {"status": "ok", "totalResults": 1, "articles": [{"source": {"name": "Reuters"}, "author": None, "url": "https://example.com/" + params["q"],
+                "publishedAt": None, "urlToImage": None, "title": "About " + params["q"], "description": None, "content": None}]}
+
+    async def first_results(results, n): # takes n results, then stops iterating
+        taken = [await results.__anext__() for _ in range(n)]
+        await results.aclose()
+        await asyncio.sleep(0.1) # long enough for every request to have finished, had it not been cancelled
+        return taken
+
+    with tempfile.TemporaryDirectory() as directory:
+        client = make_stub_client(directory, reply)
+
+        # results come out in the order they finish, not the order they were asked for
+        results = loop.run_until_complete(first_results(client.stream_keyword_search_from_sources_async(["tariffs", "eu", "brexit"], ["reuters"]), 3))
+        assert [(keyword, article.title) for keyword, article in results] == [("eu", "About eu"), ("brexit", "About brexit"), ("tariffs", "About tariffs")]
+
+        # stopping early cancels the requests still running
+        finished.clear()
+        loop.run_until_complete(first_results(client.stream_keyword_search_from_sources_async(["tariffs", "eu", "brexit"], ["reuters"]), 1))
+        assert finished == ["eu"]
+        client.close()
+
+
+def make_stub_client(directory, reply): # a NewsApiClient whose requests are answered by reply(url, params) rather than NewsAPI
+    with open(os.path.join(directory, "keys.txt"), "w") as f:
+        f.write("first/user/password/key\n")
+    with open(os.path.join(directory, "init"), "w") as f:
+        f.write("{}".format(TAGGERS)) # so the client doesnt download nltk data
+    working_directory = os.getcwd()
+    os.chdir(directory) # the client makes its image directory and looks for init in the working directory
+    try:
+        client = NewsApiClient("keys.txt")
+    finally:
+        os.chdir(working_directory)
+    client.event_loop.run_until_complete(client.http_session.close())
+    client.http_session = StubSession(reply)
+    return client
+
+
+class StubSession(object):
+    def __init__(self, reply):
+        self.reply = reply
+
+    def get(self, url, headers=None, timeout=None, params=None):
+        return StubResponse(self.reply(url, params))
+
+    async def close(self):
+        pass
+
+
+class StubResponse(object):
+    def __init__(self, reply):
+        self.reply = reply
+        self.status = 200
+        self.headers = {}
+        self.content_length = None
+
+    async def __aenter__(self):
+        self.body = await self.reply # the reply json, or the bytes of an image
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def json(self):
+        return self.body
+
+    @property
+    def content(self): # image downloads stream the body
+        return self
+
+    async def iter_chunked(self, size):
+        yield self.body
+
+
+def response_cache_tests():
+    loop = asyncio.get_event_loop()
+    cache = ResponseCache(max_entries=2, ttls={"sources": 60, "uncached": 0})
+    sent = []
+
+    async def fetch(url, payload):
+        sent.append(url)
+        await asyncio.sleep(0)
+        return {"url": url}
+
+    def get(url, payload):
+        return cache.get_or_fetch(url, payload, lambda: fetch(url, payload))
+
+    # concurrent identical requests share one fetch, and payload order doesn't matter
+    loop.run_until_complete(asyncio.gather(get("sources", {"a": 1, "b": 2}), get("sources", {"b": "2", "a": "1"})))
+    assert sent == ["sources"]
+    loop.run_until_complete(get("sources", {"a": 1, "b": 2}))
+    assert sent == ["sources"] and cache.hits == 1 and cache.coalesced == 1
+
+    # a TTL of 0 is never cached
+    loop.run_until_complete(get("uncached", {}))
+    loop.run_until_complete(get("uncached", {}))
+    assert sent.count("uncached") == 2
+
+    # the least recently used reply is evicted first
+    loop.run_until_complete(get("sources", {"page": 2}))
+    loop.run_until_complete(get("sources", {"a": 1, "b": 2}))
+    loop.run_until_complete(get("sources", {"page": 3}))
+    assert len(cache) == 2
+    loop.run_until_complete(get("sources", {"a": 1, "b": 2}))
+    assert sent.count("sources") == 3
+
+    # the caller that started a fetch getting cancelled doesn't cancel it for the others waiting on it, but the last one does
+    async def cancel_first_waiter(payload):
+        first, second = asyncio.ensure_future(get("sources", payload)), asyncio.ensure_future(get("sources", payload))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await asyncio.gather(first, second, return_exceptions=True)
+    first, second = loop.run_until_complete(cancel_first_waiter({"page": 4}))
+    assert isinstance(first, asyncio.CancelledError) and second == {"url": "sources"}
+
+    async def cancel_every_waiter(payload):
+        waiter = asyncio.ensure_future(get("sources", payload))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return await get("sources", payload)
+    assert loop.run_until_complete(cancel_every_waiter({"page": 5})) == {"url": "sources"} and sent.count("sources") == 6
+
+
+def disk_cache_tests():
+    loop = asyncio.get_event_loop()
+    sent = []
+
+    async def fetch():
+        sent.append(1)
+        return {"articles": []}
+
+    with tempfile.TemporaryDirectory() as directory:
+        # replies survive into a fresh cache over the same directory
+        loop.run_until_complete(DiskResponseCache(directory).get_or_fetch("everything", {"q": "x"}, fetch))
+        replay_cache = DiskResponseCache(directory, replay_only=True)
+        assert loop.run_until_complete(replay_cache.get_or_fetch("everything", {"q": "x"}, fetch)) == {"articles": []}
+        assert len(sent) == 1
+
+        # replay_only never falls back to the network
+        try:
+            loop.run_until_complete(replay_cache.get_or_fetch("everything", {"q": "y"}, fetch))
+            assert False
+        except NewsApiError:
+            assert len(sent) == 1
+
+        # identical requests in flight at once each save the reply without tripping over the other's temporary file
+        sent.clear()
+        all_missed = asyncio.Event()
+
+        async def fetch_together(): # nobody saves until all 8 have missed, so none of them can hit another's save
+            sent.append(1)
+            if len(sent) == 8:
+                all_missed.set()
+            await all_missed.wait()
+            return {"articles": []}
+
+        concurrent_cache = DiskResponseCache(directory)
+        replies = loop.run_until_complete(asyncio.gather(*[concurrent_cache.get_or_fetch("everything", {"q": "z"}, fetch_together) for _ in range(8)]))
+        assert replies == [{"articles": []}] * 8 and len(sent) == 8
+
+    # a truncated or corrupted reply is a miss, and is deleted
+    with tempfile.TemporaryDirectory() as directory:
+        loop.run_until_complete(DiskResponseCache(directory).get_or_fetch("everything", {"q": "x"}, fetch))
+        path = os.path.join(directory, os.listdir(directory)[0])
+        with open(path, "rb") as f:
+            data = f.read()
+        for damaged in (data[:len(data) // 2], data[:10] + b"\x00" * (len(data) - 10), b"not gzip"):
+            with open(path, "wb") as f:
+                f.write(damaged)
+            try:
+                loop.run_until_complete(DiskResponseCache(directory, replay_only=True).get_or_fetch("everything", {"q": "x"}, fetch))
+                assert False
+            except NewsApiError:
+                assert not os.path.exists(path)
+
+
+def image_store_tests():
+    loop = asyncio.get_event_loop()
+    images = {"logo": b"L" * 100, "logo-copy": b"L" * 100, "photo": b"P" * 100, "chart": b"C" * 100}
+    sent = []
+
+    async def fetch(url, headers):
+        sent.append((url, headers))
+        await asyncio.sleep(0)
+        if headers.get("If-None-Match") == url:
+            return 304, None, {}
+        return 200, images[url], {"ETag": url}
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ImageStore(directory, max_bytes=250)
+
+        # concurrent fetches of one url send one request, and two urls with the same image share one file
+        replies = loop.run_until_complete(asyncio.gather(*[store.get_or_fetch(url, fetch) for url in ["logo", "logo", "logo-copy"]]))
+        assert len(sent) == 2 and replies[0] == replies[1] == replies[2] and len(store) == 1
+
+        # fresh images are served from disk, stale ones are revalidated rather than downloaded again
+        assert loop.run_until_complete(store.get_or_fetch("logo", fetch))[1] == images["logo"] and len(sent) == 2
+        store.revalidate_after = 0
+        assert loop.run_until_complete(store.get_or_fetch("logo", fetch))[1] == images["logo"]
+        assert sent[-1] == ("logo", {"If-None-Match": "logo"}) and store.revalidated == 1
+
+        # going over max_bytes deletes the least recently used image, and the index survives a restart
+        loop.run_until_complete(store.get_or_fetch("photo", fetch))
+        loop.run_until_complete(store.get_or_fetch("chart", fetch))
+        store.save()
+        reopened_store = ImageStore(directory, max_bytes=250)
+        assert "logo" not in reopened_store and "photo" in reopened_store and "chart" in reopened_store
+        assert reopened_store.stats()["bytes"] == 200
+
+    # urls sharing an image can all write it at once, and resized copies recorded with add_files are evicted along with it
+    images.update(("mirror{}".format(i), b"M" * 100) for i in range(8))
+    with tempfile.TemporaryDirectory() as directory:
+        store = ImageStore(directory, max_bytes=250)
+        replies = loop.run_until_complete(asyncio.gather(*[store.get_or_fetch("mirror{}".format(i), fetch) for i in range(8)]))
+        assert len(store) == 1 and store.stats()["bytes"] == 100
+        thumbnail_path = os.path.join(directory, "thumbnail.jpeg")
+        with open(thumbnail_path, "wb") as f:
+            f.write(b"T" * 60)
+        loop.run_until_complete(store.add_files(replies[0][0], [thumbnail_path]))
+        assert store.stats()["bytes"] == 160
+        loop.run_until_complete(store.get_or_fetch("photo", fetch))
+        assert store.stats()["bytes"] == 100 and not os.path.exists(thumbnail_path)
+
+        # an index that can't be written doesn't fail the fetch
+        os.makedirs(os.path.join(directory, "index.json")) # os.replace can't write over a directory
+        store_index_save_every = const.IMAGE_STORE_INDEX_SAVE_EVERY
+        const.IMAGE_STORE_INDEX_SAVE_EVERY = 1
+        try:
+            assert loop.run_until_complete(store.get_or_fetch("chart", fetch))[1] == images["chart"]
+        finally:
+            const.IMAGE_STORE_INDEX_SAVE_EVERY = store_index_save_every
+
+
+def proper_noun_cache_tests():
+    cache = ProperNounCache(max_entries=2)
+    cache.put("Angela Merkel visits Paris", ["Angela Merkel", "Paris"])
+
+    # hits hand back a copy, so callers can't corrupt the cache
+    hit = cache.get("Angela Merkel visits Paris")
+    hit.append("Berlin")
+    assert cache.get("Angela Merkel visits Paris") == ["Angela Merkel", "Paris"]
+    assert cache.get("Boris Johnson in London") is None
+
+    # least recently used texts are evicted first
+    cache.put("Boris Johnson in London", ["Boris Johnson", "London"])
+    cache.get("Angela Merkel visits Paris")
+    cache.put("Emmanuel Macron in Rome", ["Emmanuel Macron", "Rome"])
+    assert cache.get("Boris Johnson in London") is None and len(cache) == 2
+
+    # the cache survives a round trip through disk
+    with tempfile.TemporaryDirectory() as directory:
+        cache.save(directory + "/proper_nouns.json")
+        reloaded_cache = ProperNounCache()
+        reloaded_cache.load(directory + "/proper_nouns.json")
+        assert reloaded_cache.get("Emmanuel Macron in Rome") == ["Emmanuel Macron", "Rome"]
+
+
+class UppercaseTagger(object): # tags capitalized words as proper nouns, standing in for nltk's tagger
+    def __init__(self):
+        self.batch_sizes = []
+
+    def tag_sents(self, sentences):
+        self.batch_sizes.append(len(sentences))
+        return [[(word, "NNP" if word[:1].isupper() else "NN") for word in words] for words in sentences]
+
+
+def proper_noun_executor_tests():
+    loop = asyncio.get_event_loop()
+    tagger = UppercaseTagger()
+    original_tagger, original_batch_size = proper_noun_extraction._tagger, const.PROPER_NOUN_BATCH_SIZE
+    proper_noun_extraction._tagger = tagger
+    const.PROPER_NOUN_BATCH_SIZE = 3
+
+    async def reply(url, params):
+        return {}
+
+    try:
+        with tempfile.TemporaryDirectory() as directory, ThreadPoolExecutor(max_workers=3) as executor:
+            client = make_stub_client(directory, reply)
+            client.proper_noun_executor = executor
+            articles = [NewsArticle(client, {"source": {"name": "Reuters"}, "author": None, "url": "https://example.com/{}".format(i), "publishedAt": None,
+                                             "urlToImage": None, "title": "Talks in City{} end".format(i), "description": "Minister{} speaks".format(i), "content": None})
+                        for i in range(5)]
+            proper_noun_cache.put(articles[2].title, ["Cached"]) # texts the cache already knows aren't tagged again
+
+            # the texts still missing are tagged in chunks of PROPER_NOUN_BATCH_SIZE, one job each
+            loop.run_until_complete(client.initialize_proper_nouns_async(articles))
+            assert sorted(tagger.batch_sizes) == [3, 3, 3]
+
+            # every article gets its own nouns back, whatever order the chunks finished in
+            assert [(article.proper_nouns_in_title, article.proper_nouns_in_description) for article in articles] == \
+                [(["Talks", "City0"], ["Minister0"]), (["Talks", "City1"], ["Minister1"]), (["Cached"], ["Minister2"]),
+                 (["Talks", "City3"], ["Minister3"]), (["Talks", "City4"], ["Minister4"])]
+
+            # and the results are merged into this process's cache, so they're never sent to a worker again
+            assert proper_noun_cache.get(articles[4].description) == ["Minister4"]
+            loop.run_until_complete(client.initialize_proper_nouns_async(articles))
+            assert len(tagger.batch_sizes) == 3
+            client.close()
+    finally:
+        proper_noun_extraction._tagger, const.PROPER_NOUN_BATCH_SIZE = original_tagger, original_batch_size
+
+
+TOKENIZER_CORPUS = [
+    "Trump took his friend Donald Trump to President Donald Trump's favorite McDonalds.",
+    "Here's how he's \"like Biden\": the U.S. and U.N. agree… or do they?",
+    "“We will win,” said Sen. Ted Cruz — (R-Texas) – on Tuesday...",
+    "‘Dreamers,’ Martin Luther King Jr. and St. Louis | NYT",
+    "Wait.. what?! A. B. C. 'quoted' words' and Merkel’s plan\r\nsecond line-with-dashes",
+    "", " ", "-", "''", "\"(\"", "a", "ab", "s's",
+]
+
+
+def legacy_tokenizer_tests():
+    # the single-pass tokenizer produces exactly the token stream of the original one
+    for text in TOKENIZER_CORPUS:
+        assert text_preprocess(text) == legacy_text_preprocess(text), text
+
+    generator = random.Random(0)
+    alphabet = list("ab Xs.,?!:-|'\"()\r\n") + ["“", "”", "‘", "’", "—", "–", "…", "...", "..", "Jr.", "St."]
+    for _ in range(20000):
+        text = "".join(generator.choice(alphabet) for _ in range(generator.randint(0, 12)))
+        assert text_preprocess(text) == legacy_text_preprocess(text), text
+
+
+# the tokenizer as it was before it was rewritten as a single pass, kept to check the new one against
+def legacy_text_preprocess(text):
+    for seperator in WORD_SEPERATORS:
+        text = text.replace(seperator, ' ')
+
+    words = text.split(' ')
+    words = legacy_punctuation_parse(words)
+    return [word for word in words if word != ""]
+
+
+def legacy_punctuation_parse(words):
+    ret = []
+    for word in words:
+        parsed_word = word
+        split_at_beginning = False
+        split_at_end = False
+
+        if len(word) < 2 or word in NODE_DISTINGUISHERS: # one-length words not only are definitely not proper nouns, they also break [-2] checks:
+            ret.append(word)
+            continue # so just add it and skip to the next word
+
+        for interruptor in SENTENCE_INTERRUPTORS:
+            try:
+                if parsed_word[0] == interruptor:
+                    parsed_word = parsed_word[1:]
+                    split_at_beginning = True
+                if parsed_word[-2] == interruptor:
+                    parsed_word = parsed_word [:-2] # catches things like Here's how he's "like Biden":
+                    split_at_end = True
+                elif parsed_word[-1] == interruptor:
+                    parsed_word = parsed_word[:-1]
+                    split_at_end = True
+            except IndexError:
+                pass
+
+        for ellipse in ELLIPSES:
+            try:
+                if parsed_word[-len(ellipse):] == ellipse:
+                    parsed_word = parsed_word[-len(ellipse):]
+                    split_at_end = True
+            except IndexError: # if the word isnt long enough to fit an ellipse
+                pass # its not the end of the world
+
+        for punctuation_mark in PUNCTUATION: # only have to check the end of the word for punctuation
+            try:
+                if parsed_word[-1] == punctuation_mark and len(word) > 2: # a single letter followed by punctuation is usually an initial, not a sentence split
+                    parsed_word = parsed_word[:-1]
+                    split_at_end = True
+                elif parsed_word[-2] == punctuation_mark: # catches things like 'Dreamers,' = > ["Dreamers"] and not ["Dreamers,"]
+                    parsed_word = parsed_word[:-2]
+                    split_at_end = True
+            except IndexError: # if the word is under two characters long
+                pass # were done here
+
+        for single_quote in SINGLE_QUOTES: # we have to parse these seperately because of possessives
+            try:
+                if parsed_word[0] == single_quote:  # if it begins in a single quote, its probably the start of quoted text
+                    parsed_word = parsed_word[1:]
+                    split_at_beginning = True
+                if parsed_word[-2:] == (single_quote + "s"):  # if the word ends in 's, it's probably a possessive
+                    parsed_word = parsed_word[:-2] # add it back to that list with the possessive removed
+                    split_at_end = True # so that "Trump's Ford" gets parsed as ["Trump, Ford"] and not ["Trump Ford"]
+                elif parsed_word[-1] == single_quote:  # if it just ends in a single quote, it might be a possessive or the end of quoted text
+                    parsed_word = parsed_word[:-1]  # so just remove the quote and see how it parses without it
+                    split_at_end = True # either of those would end a thought chunk, though
+            except IndexError: # if the word isnt long enough to fit some single quotes
+                pass # its not the end of the world
+
+        if split_at_beginning:
+            ret.append(PUNCTUATION_REPLACEMENT)
+        ret.append(parsed_word)
+        if split_at_end:
+            ret.append(PUNCTUATION_REPLACEMENT)
+
+    return ret
+
+
 if __name__ == "__main__":
-    select_better_proper_noun_from_tests()
\ No newline at end of file
+    select_better_proper_noun_from_tests()
+    proper_noun_merger_tests()
+    entity_index_tests()
+    format_text_tests()
+    lazy_article_tests()
+    parse_newsapi_time_tests()
+    news_article_batch_tests()
+    article_export_tests()
+    near_duplicate_index_tests()
+    image_pipeline_tests()
+    sniff_image_tests()
+    image_result_tests()
+    key_pool_tests()
+    retry_policy_tests()
+    request_scheduler_tests()
+    iter_everything_tests()
+    stream_requests_tests()
+    response_cache_tests()
+    disk_cache_tests()
+    image_store_tests()
+    proper_noun_cache_tests()
+    proper_noun_executor_tests()
+    legacy_tokenizer_tests()
\ No newline at end of file
@@ -12,7 +12,7 @@ install_requires = [
 
 tests_require = []
 
-python_requires = '>=3'
+python_requires = '>=3.7' # contextvars and datetime.fromisoformat
 
 setup(
     name='newsapy',
@@ -21,6 +21,7 @@ setup(
     license='MIT',
     url='https://everyonegetinhere.com',
     install_requires=install_requires,
+    python_requires=python_requires,
     description='An unofficial asynchronous, key-switching Python client for NewsAPI',
     download_url='https://github.com/CocoPommel/newsapy/archive/0.2.12.tar.gz',
     keywords=['newsapy', 'newsapi', 'news'],
@@ -31,8 +32,10 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 )